@@ -36,11 +36,32 @@ logger = logging.getLogger(__name__)
 # PUBLIC INTERFACE                                                             #
 ################################################################################
 
-import re, os, json
-from dataclasses import astuple, asdict
+import re, json, time
+import operator
+import hashlib, hmac
+import unicodedata
+from secrets import randbelow, token_hex
+from dataclasses import fields
+from itertools import islice
 
 from tivua.database import Transaction, Post, User, UniqueKeyViolationError
-from tivua.database_filters import FilterUID, FilterAuthor
+
+# Names of the fields in the Post dataclass
+_POST_FIELDS = tuple(field.name for field in fields(Post))
+
+# Function returning a tuple with the values of all fields of a post
+_POST_VALUES = operator.attrgetter(*_POST_FIELDS)
+
+# Names of the fields in the User dataclass
+_USER_FIELDS = tuple(field.name for field in fields(User))
+
+# Names of the User dataclass fields returned by API.get_user_list(), with and
+# without credentials. The password hash is never returned.
+_USER_FIELDS_CREDENTIALS = tuple(name for name in _USER_FIELDS
+                                 if name != "password")
+_USER_FIELDS_PUBLIC = tuple(
+    name for name in _USER_FIELDS_CREDENTIALS
+    if not name in {"role", "auth_method", "reset_password"})
 
 
 class ValidationError(ValueError):
@@ -110,22 +131,46 @@ class Perms:
 
     @staticmethod
     def is_valid_role(role):
-        return role in list(Perms.USER_ROLES.keys())
+        return role in Perms.USER_ROLES
 
     @staticmethod
     def lookup_role_permissions(role):
         """
         Converts a "role" string into a set of permissions.
         """
-        if not role in Perms.USER_ROLES:
-            return Perms.NONE
-        return Perms.USER_ROLES[role]
+        return Perms.USER_ROLES.get(role, Perms.NONE)
 
     @staticmethod
     def role_has_permission(role, permission):
         return (Perms.lookup_role_permissions(role) & permission) == permission
 
 
+def _make_type_checker(D):
+    """
+    Creates a function that makes sure that all fields of an instance of the
+    dataclass D are either None or of the annotated type (ints are accepted
+    in place of bools). The field names and types are extracted once, instead
+    of being looked up whenever an object is checked.
+    """
+    checks = tuple((field.name, field.type, field.type is bool)
+                   for field in fields(D))
+
+    def check(o):
+        for name, type_, is_bool in checks:
+            value = getattr(o, name)
+            if not ((value is None) or isinstance(value, type_) or
+                    (is_bool and type(value) is int)):
+                logger.debug("Expected {} but got {}".format(
+                    str(type_), type(value)))
+                raise ValidationError("%server_error_invalid_type")
+
+    return check
+
+
+_check_post_types = _make_type_checker(Post)
+_check_user_types = _make_type_checker(User)
+
+
 class API:
     ############################################################################
     # Initialization                                                           #
@@ -139,6 +184,14 @@ class API:
         """
         self.db = db
         self.perform_initialisation = perform_initialisation
+        self._salt_cache = None  # Decoded password salt, see _hash_password
+        self._config_cache = None  # See get_configuration_object
+        self._user_cache = {}  # See _lookup_login_user
+        self._keyword_cache = None  # See get_keyword_list
+        self._last_challenge_purge = None  # See purge_stale
+        self._last_session_purge = None
+        self._last_maintenance = None  # See maintenance
+        self._user_cache_version = None
         self._init()
 
     def __enter__(self):
@@ -168,10 +221,13 @@ class API:
         """
         # Fetch the config dict
         config = self.db.configuration
+        self._salt_cache = None
+        self._config_cache = None
+        self._user_cache.clear()
 
         # Generate the cryptographic salt used to hash passwords
         if not ("salt" in config):
-            salt = os.urandom(32).hex()
+            salt = token_hex(32)
             config["salt"] = salt
             logger.warning("Initialized password salt to \"%s\"", salt)
 
@@ -195,11 +251,7 @@ class API:
 
         # Try to find a user with administrative rights or user named "admin"
         # that has a valid password set
-        admin_user = None
-        for user in self.db.list_users():
-            if (user.name == "admin" or user.role == "admin"):
-                admin_user = user
-                break
+        admin_user = self.db.get_admin_user()
 
         # Abort if the admin user has a valid password
         empty_password = "0" * 64
@@ -232,6 +284,7 @@ class API:
                               reset_password=True)
 
         # Update/create the user
+        self._user_cache.clear()
         if admin_user.uid is None:
             self.db.create_user(admin_user)
         else:
@@ -241,20 +294,6 @@ class API:
     # Helper functions                                                         #
     ############################################################################
 
-    @staticmethod
-    def _is_type_or_none(o, type_):
-        """
-        Makes sure the given object o is either None or of the given type.
-        """
-        if o is None:
-            return True
-        elif isinstance(o, type_):
-            return True
-        elif (type_ is bool) and type(o) is int:
-            return True  # Allow conversion from int -> bool
-        else:
-            return False
-
     @staticmethod
     def _dataclass_from_dict(D, x):
         """
@@ -262,16 +301,8 @@ class API:
         In particular, only passes the keys in "x" to the data class constructor
         that are also valid fields in the dataclass.
         """
-        keys = set(D.__dataclass_fields__.keys()) & set(x.keys())
-        return D(**{key: x[key] for key in keys})
-
-    @staticmethod
-    def _dataclass_check_types(o):
-        for name, field in o.__dataclass_fields__.items():
-            if not API._is_type_or_none(getattr(o, name), field.type):
-                logger.debug("Expected {} but got {}".format(
-                    str(field.type), type(getattr(o, name))))
-                raise ValidationError("%server_error_invalid_type")
+        fields_ = D.__dataclass_fields__
+        return D(**{key: value for key, value in x.items() if key in fields_})
 
     ############################################################################
     # Configuration                                                            #
@@ -282,24 +313,40 @@ class API:
         Returns a JSON serialisable object containing the global configuration
         options.
         """
-        with Transaction(self.db):
-            c = self.db.configuration
-            return {
-                "login_methods": {
-                    "username_password":
+
+        # The configuration object is requested on every page load. Cache it
+        # and only re-read it if it was changed by this API instance (which
+        # resets the cache) or if another process (i.e., the command line
+        # interface) changed the database.
+        data_version = self.db.data_version()
+        if (self._config_cache is None) or (self._config_cache[0] !=
+                                            data_version):
+            with Transaction(self.db):
+                c = self.db.configuration
+                self._config_cache = (data_version, (
                     c["login_method_username_password"] == "1",
-                    "cas": c["login_method_cas"] == "1",
-                },
-                "salt": c["salt"],
-            }
+                    c["login_method_cas"] == "1",
+                    c["salt"],
+                ))
+
+        # Build a new object from the cached values on every call, such that
+        # callers cannot modify the cache
+        username_password, cas, salt = self._config_cache[1]
+        return {
+            "login_methods": {
+                "username_password": username_password,
+                "cas": cas,
+            },
+            "salt": salt,
+        }
 
     ############################################################################
     # Cryptographic utilities                                                  #
     ############################################################################
 
-    # Regular expression used to check that an identifier corresponds to a
-    # 32-byte (64 characters, 256 bits) hex string
-    HEX64_RE = re.compile("^[a-f0-9]{64}$")
+    # Set of characters that may occur in a 32-byte (64 characters, 256 bits)
+    # lower-case hex string, see _is_hex64()
+    HEX64_CHARS = frozenset("0123456789abcdef")
 
     # Number of iterations in the PBKDF2 HMAC algorithm
     PBKDF2_COUNT = 10000
@@ -315,42 +362,51 @@ class API:
                the specified hex-string is used.
         @return a hex-string containing the hashed password.
         """
-        import hashlib
-
         if isinstance(password, str):
             password = password.encode("utf-8")
         if salt is None:
-            salt = self.db.configuration["salt"]
+            # The salt stored in the database only changes when the database
+            # is initialised or a backup is imported; cache the decoded bytes.
+            # Re-read the salt if another process wrote to the database.
+            data_version = self.db.data_version()
+            if (self._salt_cache is None) or (self._salt_cache[0] !=
+                                              data_version):
+                self._salt_cache = (data_version,
+                                    API._decode_salt(
+                                        self.db.configuration["salt"]))
+            salt = self._salt_cache[1]
+        else:
+            salt = API._decode_salt(salt)
+
+        # Note: pbkdf2_hmac performs all iterations in a single call into
+        # OpenSSL, which uses hardware SHA-256 extensions where available.
+        return hashlib.pbkdf2_hmac("sha256", password, salt, API.PBKDF2_COUNT,
+                                   dklen=32).hex()
+
+    @staticmethod
+    def _decode_salt(salt):
+        """
+        Converts the given salt into a 32-byte bytes object. Raises a
+        ValidationError if the salt is invalid.
+        """
         if isinstance(salt, str):
-            if not API.HEX64_RE.match(salt):
-                raise ValidationError()
-            salt = bytes.fromhex(salt)
+            return _decode_hex64(salt)
         if isinstance(salt, bytes) and len(salt) != 32:
             raise ValidationError()
-
-        return hashlib.pbkdf2_hmac("sha256", password, salt,
-                                   API.PBKDF2_COUNT).hex()
+        return salt
 
     @staticmethod
     def create_random_password(n=10):
         """
-        Creates a random password. Eliminates modulo bias by reading multiple
-        bytes from the random source at once. Uses a limited alphabet that
+        Creates a random password. Uses secrets.randbelow, which eliminates
+        modulo bias by rejection sampling. Uses a limited alphabet that
         ensures not using letters that are easy to confuse and that are on
         different locations on QWERTZ vs QWERTY keyboards (sorry, AZERTY users).
 
         @param n is the number of characters in the password.
         """
         alphabet = "23456789ABCDEFGHJKLMNPQRSTUVWXabcdefghijkmnpqrstuvwx"
-        password = [" "] * n
-        accu, mul = 0, 16
-        for i, r in enumerate(os.urandom(mul * n)):
-            if i % mul == mul - 1:
-                password[i // mul] = alphabet[accu % len(alphabet)]
-                accu = 0
-            else:
-                accu = (accu << 8) + r
-        return "".join(password)
+        return "".join(alphabet[randbelow(len(alphabet))] for _ in range(n))
 
     ############################################################################
     # Session management                                                       #
@@ -376,10 +432,7 @@ class API:
 
         with Transaction(self.db):
             # Fetch the current UNIX time and create a random challenge
-            challenge = os.urandom(32).hex()
-
-            # Delete old challenges
-            self.db.purge_stale_challenges(API.CHALLENGE_TIMEOUT)
+            challenge = token_hex(32)
 
             # Store the challenge and its creation time in the database
             self.db.challenges[challenge] = self.db.now()
@@ -393,22 +446,100 @@ class API:
     def _check_password_login_challenge(self, challenge):
         """
         Used internally. Returns True and deletes the given challenge if it
-        existed, returns
-        False if the challenge is invalid (i.e. too old).
-        """
+        existed, returns False if the challenge is invalid (i.e. too old).
+        """
+        return self.db.consume_challenge(challenge, API.CHALLENGE_TIMEOUT)
+
+    # Minimum time between two purges of stale challenges and sessions in
+    # seconds, see purge_stale()
+    CHALLENGE_PURGE_INTERVAL = CHALLENGE_TIMEOUT / 4
+    SESSION_PURGE_INTERVAL = SESSION_TIMEOUT / 24
+
+    def purge_stale(self):
+        """
+        Deletes stale challenges and sessions from the database. Stale
+        challenges and sessions are never accepted, so this only serves to keep
+        the corresponding tables small. Calls to this function are cheap; the
+        tables are only actually purged if the last purge is older than
+        CHALLENGE_PURGE_INTERVAL or SESSION_PURGE_INTERVAL, respectively.
+        """
+        now = time.monotonic()
+        purge_challenges = ((self._last_challenge_purge is None) or
+                            (now - self._last_challenge_purge >=
+                             API.CHALLENGE_PURGE_INTERVAL))
+        purge_sessions = ((self._last_session_purge is None) or
+                          (now - self._last_session_purge >=
+                           API.SESSION_PURGE_INTERVAL))
+        if not (purge_challenges or purge_sessions):
+            return
 
+        # Only record the time of the purge once the transaction succeeded,
+        # such that a failed purge is retried on the next call
         with Transaction(self.db):
-            # Delete stale challenges
-            self.db.purge_stale_challenges(API.CHALLENGE_TIMEOUT)
-
-            # Check whether the callenge exists
-            if not challenge in self.db.challenges:
-                return False
-
-            # Delete the challenge
-            del self.db.challenges[challenge]
-
-            return True
+            if purge_challenges:
+                self.db.purge_stale_challenges(API.CHALLENGE_TIMEOUT)
+            if purge_sessions:
+                self.db.purge_stale_sessions(API.SESSION_TIMEOUT)
+        if purge_challenges:
+            self._last_challenge_purge = now
+        if purge_sessions:
+            self._last_session_purge = now
+
+    # Interval in seconds between database maintenance runs
+    MAINTENANCE_INTERVAL = 6 * 60 * 60
+
+    def maintenance(self):
+        """
+        Performs database maintenance, i.e., updates the statistics used by the
+        query planner. Calls to this function are cheap; the maintenance tasks
+        are only executed on the first call and whenever the last run is older
+        than MAINTENANCE_INTERVAL. This should only be used for long-lived
+        connections, i.e., by the server. The time of the last run is only
+        updated if the maintenance tasks succeeded, such that failed runs are
+        retried on the next call.
+        """
+        now = time.monotonic()
+        if self._last_maintenance is None:
+            self.db.maintenance(initial=True)
+            self._last_maintenance = now
+        elif now - self._last_maintenance >= API.MAINTENANCE_INTERVAL:
+            self.db.maintenance()
+            self._last_maintenance = now
+
+    # Maximum number of entries in the user cache used by _lookup_login_user
+    USER_CACHE_SIZE = 1024
+
+    def _lookup_login_user(self, user_name):
+        """
+        Returns a tuple (user, password) containing the user with the given
+        name and the decoded password hash of that user. Returns (None, None)
+        if the user does not exist. Results are cached; the cache is reset
+        whenever this API instance modifies users, or whenever another process
+        changed the database.
+
+        @param user_name is the canonical name of the user that should be
+               looked up.
+        """
+
+        # Discard the cache if another connection wrote to the database
+        data_version = self.db.data_version()
+        if data_version != self._user_cache_version:
+            self._user_cache.clear()
+            self._user_cache_version = data_version
+
+        # Fetch the user from the database if it is not in the cache. Do not
+        # cache non-existing users, otherwise clients could fill the cache
+        # with random user names.
+        res = self._user_cache.get(user_name)
+        if res is None:
+            user = self.db.get_user_by_name(user_name)
+            if user is None:
+                return None, None
+            if len(self._user_cache) >= API.USER_CACHE_SIZE:
+                self._user_cache.clear()
+            res = self._user_cache[user_name] = (user,
+                                                 bytes.fromhex(user.password))
+        return res
 
     def _login_method_username_password(self, user_name, challenge, response):
         """
@@ -419,8 +550,8 @@ class API:
         # correct format
         user_name = str(user_name).strip().lower()
         challenge, response = str(challenge), str(response)
-        if not (API.USER_RE.match(user_name) and API.HEX64_RE.match(challenge)
-                and API.HEX64_RE.match(response)):
+        if not (_USER_MATCH(user_name) and _is_hex64(challenge)
+                and _is_hex64(response)):
             raise ValidationError()
 
         # Make sure the valid is valid (do this outside of the transaction
@@ -428,39 +559,40 @@ class API:
         if not self._check_password_login_challenge(challenge):
             raise AuthentificationError()
 
-        # Lookup the user, check the user role and compute the expected response
-        with Transaction(self.db):
-            # Make sure the user exists. If the user name does not exist, raise
-            # an authentification error, i.e. do not expose the users'
-            # non-existance to the client
-            user = self.db.get_user_by_name(user_name)
-            if user is None:
-                raise AuthentificationError()
+        # Make sure the user exists. If the user name does not exist, raise
+        # an authentification error, i.e. do not expose the users'
+        # non-existance to the client
+        user, password = self._lookup_login_user(user_name)
+        if user is None:
+            raise AuthentificationError()
 
-            # Make sure the user can actually login using a password
-            if user.auth_method != "password":
-                raise AuthentificationError()
+        # Make sure the user can actually login using a password
+        if user.auth_method != "password":
+            raise AuthentificationError()
 
-            # Make sure the user has the right permissions
-            if Perms.lookup_role_permissions(user.role) <= 0:
-                raise AuthentificationError()
+        # Make sure the user has the right permissions
+        if Perms.lookup_role_permissions(user.role) <= 0:
+            raise AuthentificationError()
 
-            # Compute the expected password hash
-            expected_response = self._hash_password(
-                bytes.fromhex(user.password), challenge)
-            if expected_response != response:
-                raise AuthentificationError()
+        # Compute the expected password hash. This is slow by design; do this
+        # outside of any transaction to not block other database users. The
+        # challenge has already been validated above, decode it directly.
+        expected_response = self._hash_password(password,
+                                                bytes.fromhex(challenge))
+        if not hmac.compare_digest(expected_response, response):
+            raise AuthentificationError()
 
+        with Transaction(self.db):
             # Okay, all this worked. Let's create a session for the user and
             # return the sid
-            sid = os.urandom(32).hex()
+            sid = token_hex(32)
             self.db.create_session(sid, user.uid)
             return self.get_session_data(sid)
 
     # Login should be a constant time function -- otherwise we're leaking
     # information about whether a user exists or not (because checking the
     # challenge response is really slow).
-    LOGIN_CONSTANT_TIME = 50e-3  # Always use 50ms
+    LOGIN_CONSTANT_TIME_NS = 50_000_000  # Always use 50ms
 
     def login_method_username_password(self, user_name, challenge, response):
         """
@@ -473,25 +605,22 @@ class API:
         @param response is the challenge response generated by the user.
         """
 
-        # Avoid leaking information by making this a constant-time function
-        import time
+        # Avoid leaking information by making this a constant-time function.
+        # Use a monotonic clock, the wall clock may jump.
+        deadline = time.monotonic_ns() + API.LOGIN_CONSTANT_TIME_NS
         try:
-            begin = time.time()
             return self._login_method_username_password(
                 user_name, challenge, response)
         finally:
-            end = time.time()
-            time.sleep(
-                max(
-                    0.0,
-                    min(API.LOGIN_CONSTANT_TIME,
-                        API.LOGIN_CONSTANT_TIME - (end - begin))))
+            delay = deadline - time.monotonic_ns()
+            if delay > 0:
+                time.sleep(delay * 1e-9)
 
     def logout(self, sid):
         """
         Simply deletes the given session identifier from the DB.
         """
-        if not API.HEX64_RE.match(sid):
+        if not _is_hex64(sid):
             raise ValidationError()
         self.db.delete_session(sid)
 
@@ -513,26 +642,23 @@ class API:
         """
 
         # Validate the session identifier
-        if not API.HEX64_RE.match(sid):
+        if not _is_hex64(sid):
             raise ValidationError()
 
-        # Remove any stale sessions, then try to fetch the user data associated
-        # with the session
-        self.db.purge_stale_sessions(API.SESSION_TIMEOUT)
+        # Try to fetch the user data associated with the session
         with Transaction(self.db):
-            # Fetch the UID corresponding to the session
-            uid = self.db.get_session_uid(sid)
-            if not uid:
+            # Advance the session mtime; this fails if the session does not
+            # exist or is stale
+            if not self.db.update_session_mtime(sid, API.SESSION_TIMEOUT):
                 return None
 
-            # Advance the session mtime
-            self.db.update_session_mtime(sid)
-
-            # Get the user data associated with the UID
-            user = self.db.get_user_by_id(uid)
+            # Get the user data associated with the session
+            user = self.db.get_session_user(sid)
+            if user is None:
+                return None
             return {
                 "sid": sid,
-                "uid": uid,
+                "uid": user.uid,
                 "name": user.name,
                 "display_name": user.display_name,
                 "role": user.role,
@@ -547,16 +673,22 @@ class API:
     # from storing arbitrary data in the session.
     MAX_SETTINGS_LEN = 1024
 
+    @staticmethod
+    def _dump_settings(settings):
+        """
+        Serialises the given settings object into the string representation
+        stored in the database.
+        """
+        return json.dumps(settings, sort_keys=True)
+
     def get_user_settings(self, uid):
         """
         Reads the user settings from the database and serialises them into a
         JSON object. Returns an empty object if the user has not stored any
         settings yet.
         """
-        with Transaction(self.db):
-            if (uid in self.db.settings):
-                return json.loads(self.db.settings[uid])
-            return {}
+        settings_str = self.db.settings.lookup(uid)
+        return {} if settings_str is None else json.loads(settings_str)
 
     def update_user_settings(self, uid, settings):
         """
@@ -571,21 +703,32 @@ class API:
         if not isinstance(settings, dict):
             raise ValidationError()
 
+        # Serialise the given settings to a string. Merging the old settings
+        # can only add keys, so reject objects that are already too large
+        # before touching the database.
+        settings_str = API._dump_settings(settings)
+        if len(settings_str) > API.MAX_SETTINGS_LEN:
+            raise ValidationError()
+
         # Perform the update
         with Transaction(self.db):
-            # Merge the new settings with the old values
-            if (uid in self.db.settings):
-                for key, value in json.loads(self.db.settings[uid]).items():
+            # Merge the new settings with the old values. Only serialise the
+            # settings again if some old keys were actually merged.
+            old_settings_str = self.db.settings.lookup(uid)
+            if not old_settings_str is None:
+                merged = False
+                for key, value in json.loads(old_settings_str).items():
                     if not key in settings:
                         settings[key] = value
-
-            # Serialise the settings to a string
-            settings_str = json.dumps(settings, sort_keys=True)
-            if len(settings_str) > API.MAX_SETTINGS_LEN:
-                raise ValidationError()
-
-            # Store the merged values in the database
-            self.db.settings[uid] = settings_str
+                        merged = True
+                if merged:
+                    settings_str = API._dump_settings(settings)
+                    if len(settings_str) > API.MAX_SETTINGS_LEN:
+                        raise ValidationError()
+
+            # Store the merged values in the database, unless nothing changed
+            if settings_str != old_settings_str:
+                self.db.settings[uid] = settings_str
             return settings
 
     ############################################################################
@@ -601,8 +744,9 @@ class API:
     # Maximum number of keywords per post
     KEYWORDS_MAX_COUNT = 10
 
-    # Regular expression used to split a keyword into individual keywords
-    KEYWORDS_SPLIT_RE = re.compile("[\n;:().,!?/]")
+    # Translation table mapping all characters that separate individual
+    # keywords onto ","
+    KEYWORDS_SPLIT_TABLE = str.maketrans(dict.fromkeys("\n;:().,!?/", ","))
 
     @staticmethod
     def coerce_keywords(keywords):
@@ -619,41 +763,36 @@ class API:
         if isinstance(keywords, list):
             keywords_list = keywords
         elif isinstance(keywords, str):
-            keywords_list = re.split(API.KEYWORDS_SPLIT_RE, keywords)
+            keywords_list = keywords.translate(
+                API.KEYWORDS_SPLIT_TABLE).split(",")
         else:
             raise ValidationError("%server_error_invalid_type")
 
-        # Trim any whitespace and convert to lowercase
-        keywords_list = map(lambda x: x.strip().lower(), keywords_list)
-
-        # Remove empty keywords, convert the iterator to a list
-        keywords_list = list(filter(lambda x: x, keywords_list))
-
-        # Convert the keywords to a list and check that the total number of
-        # keywords does not exceed the maximum
-        if len(keywords_list) > API.KEYWORDS_MAX_COUNT:
-            raise ValidationError("%server_error_too_many_keywords")
-
-        # Remove duplicates while preserving their order
-        keywords_set = set()
-        i = 0
-        while i < len(keywords_list):
-            keyword = keywords_list[i]
-            if keyword in keywords_set:
-                del keywords_list[i]
-            else:
-                keywords_set.add(keyword)
-                i += 1
-
-        # Make sure the keywords are not longer or shorter than the minimum/
-        # maximum length
+        # Trim any whitespace, convert to lowercase, remove empty keywords and
+        # duplicates while preserving the order, and make sure that the
+        # keywords are neither too long nor too short -- all in a single pass.
+        # Duplicates count towards the maximum number of keywords.
+        count, keywords_dict = 0, {}
         for keyword in keywords_list:
-            if (len(keyword) > API.KEYWORDS_MAX_LEN) or (len(keyword) <
-                                                         API.KEYWORDS_MIN_LEN):
+            keyword = keyword.strip().lower()
+            if not keyword:
+                continue
+
+            # Check that the total number of keywords does not exceed the
+            # maximum
+            count += 1
+            if count > API.KEYWORDS_MAX_COUNT:
+                raise ValidationError("%server_error_too_many_keywords")
+
+            # Make sure the keywords are not longer or shorter than the
+            # minimum/maximum length
+            n = len(keyword)
+            if (n > API.KEYWORDS_MAX_LEN) or (n < API.KEYWORDS_MIN_LEN):
                 raise ValidationError("%server_error_invalid_keyword_len")
+            keywords_dict[keyword] = None
 
         # Return a string with the keywords separated by ","
-        return ",".join(keywords_list)
+        return ",".join(keywords_dict)
 
     @staticmethod
     def coerce_post(post):
@@ -690,32 +829,43 @@ class API:
         p.keywords = API.coerce_keywords(p.keywords)
 
         # Make sure all types are correct
-        API._dataclass_check_types(p)
+        _check_post_types(p)
 
         return p
 
     @staticmethod
     def _split(s, r=","):
-        return list(filter(lambda x: x, s.split(r)))
+        """
+        Splits the string s at the separator r and discards empty elements.
+        """
+        return [x for x in s.split(r) if x] if s else []
 
     @staticmethod
-    def _post_to_dict(post):
+    def _post_to_dict(post, keywords=None):
         """
         Helper function that splits post keywords into an array before returning
         them to the callers of the post functions.
+
+        @param post is the tivua.database.Post object that should be converted.
+        @param keywords is an optional list containing the already split
+               keywords of the post.
         """
 
         # Return nothing if the post object is empty
         if post is None:
             return None
 
-        # Convert the post object dataclass to a dictionary
-        post = asdict(post)
+        # Convert the post object dataclass to a dictionary. All fields are
+        # immutable scalars, so there is no need for the deep copy performed
+        # by dataclasses.asdict.
+        res = dict(zip(_POST_FIELDS, _POST_VALUES(post)))
 
         # Convert the keywords to a list
-        post["keywords"] = API._split(post["keywords"])
+        if keywords is None:
+            keywords = API._split(post.keywords)
+        res["keywords"] = keywords
 
-        return post
+        return res
 
     def get_post_list(self, start, limit, filter=None):
         """
@@ -731,7 +881,7 @@ class API:
         posts = self.db.list_posts(start, limit, False, filter)
 
         # Convert the posts to dictionaries
-        return list(map(API._post_to_dict, posts))
+        return [API._post_to_dict(post) for post in posts]
 
     def get_post(self, pid):
         """
@@ -769,12 +919,12 @@ class API:
             self.db.update_fulltext(p.pid, p)
 
             # Insert keywords
-            keywords = self.db.keywords
-            for keyword in API._split(p.keywords):
-                keywords[keyword] = p.pid
+            keywords = API._split(p.keywords)
+            self.db.keywords.update((keyword, p.pid) for keyword in keywords)
+            self._keyword_cache = None
 
             # Convert the post back to a dictionary
-            return API._post_to_dict(p)
+            return API._post_to_dict(p, keywords)
 
     def update_post(self, post):
         """
@@ -813,10 +963,16 @@ class API:
             # Insert the old post into the history table
             self.db.create_post(old_post, history=True)
 
-            # Remove keywords associated with the old post
+            # Only touch the keywords that were actually added or removed
             keywords = self.db.keywords
-            for keyword in API._split(old_post.keywords):
-                keywords[keyword] = keywords[keyword] - set((pid, ))
+            self._keyword_cache = None
+            new_keywords_list = API._split(p.keywords)
+            old_keywords = set(API._split(old_post.keywords))
+            new_keywords = set(new_keywords_list)
+
+            # Remove keywords no longer associated with the post
+            keywords.discard_items(
+                (keyword, pid) for keyword in old_keywords - new_keywords)
 
             # Update the post in the normal posts table
             if self.db.update_post(p) == 0:
@@ -826,11 +982,10 @@ class API:
             self.db.update_fulltext(pid, p)
 
             # Insert the new keywords
-            keywords = self.db.keywords
-            for keyword in API._split(p.keywords):
-                keywords[keyword] = pid
+            keywords.update(
+                (keyword, pid) for keyword in new_keywords - old_keywords)
 
-            return API._post_to_dict(p)
+            return API._post_to_dict(p, new_keywords_list)
 
     def delete_post(self, pid):
         # Make sure the given post id is and integer and non-negative
@@ -843,10 +998,11 @@ class API:
             if post is None:
                 raise NotFoundError()
 
-            # Delete all keywords associated with the post
-            keywords = self.db.keywords
-            for keyword in API._split(post.keywords):
-                keywords[keyword] = keywords[keyword] - set((pid, ))
+            # Delete all keywords associated with the post using a targeted
+            # DELETE per (keyword, pid) pair
+            self._keyword_cache = None
+            self.db.keywords.discard_items(
+                (keyword, pid) for keyword in API._split(post.keywords))
 
             # Delete the post from the history, the main post table, and the
             # fulltext search index
@@ -863,7 +1019,17 @@ class API:
         Returns an object containing the used keywords and their absolute
         counts.
         """
-        return {key: count for key, count in self.db.keywords.key_counts()}
+
+        # The keyword list is requested whenever the user interface is
+        # loaded. Cache it and only re-read it if the keywords were changed by
+        # this API instance, or if another process changed the database.
+        data_version = self.db.data_version()
+        if (self._keyword_cache is None) or (self._keyword_cache[0] !=
+                                             data_version):
+            with Transaction(self.db):
+                self._keyword_cache = (data_version,
+                                       dict(self.db.keywords.key_counts()))
+        return dict(self._keyword_cache[1])
 
     ############################################################################
     # Users                                                                    #
@@ -880,6 +1046,10 @@ class API:
         "þ": "th",
     }
 
+    # Translation table corresponding to USERNAME_REPLACEMENTS; this allows to
+    # apply all replacements in a single pass
+    USERNAME_TRANSLATE = str.maketrans(USERNAME_REPLACEMENTS)
+
     # Maximum length of the display_name property
     MAX_DISPLAY_NAME_LEN = 32
 
@@ -888,7 +1058,6 @@ class API:
         """
         Creates a username from a display name.
         """
-        import unicodedata
 
         # Try to split the name into first and last name
         parts = API._split(name.strip().lower(), " ")
@@ -900,10 +1069,12 @@ class API:
             username = parts[0][0] + parts[-1]
 
         # Apply some replacements
-        for src, tar in API.USERNAME_REPLACEMENTS.items():
-            username = username.replace(src, tar)
+        username = username.translate(API.USERNAME_TRANSLATE)
 
-        # Convert the string to ascii
+        # Convert the string to ascii. Pure ASCII strings are already
+        # normalised; this is the common case.
+        if username.isascii():
+            return username[0:8]
         username = unicodedata.normalize('NFKD', username)
         return str(username.encode('ascii', 'ignore'), 'ascii')[0:8]
 
@@ -916,7 +1087,14 @@ class API:
         """
 
         # Try to create a User object
-        u = API._dataclass_from_dict(User, user)
+        return API._coerce_user_obj(API._dataclass_from_dict(User, user))
+
+    @staticmethod
+    def _coerce_user_obj(u):
+        """
+        Same as coerce_user(), but operates on a tivua.database.User object.
+        The given object is updated in place and returned.
+        """
 
         # The uid must not be zero
         if u.uid == 0:
@@ -942,12 +1120,14 @@ class API:
         if not u.display_name:
             u.display_name = u.name
 
-        # Capitalise the first letter of the display name
-        if len(u.display_name) > 0:
-            u.display_name = u.display_name[0:1].upper() + u.display_name[1:]
+        # Capitalise the first letter of the display name; do not touch the
+        # remaining letters. Skip this if the name already is capitalised.
+        first = u.display_name[0:1]
+        if first and not first.isupper():
+            u.display_name = first.upper() + u.display_name[1:]
 
         # Make sure the name matches the user name regular expression
-        if not API.USER_RE.match(u.name):
+        if not _USER_MATCH(u.name):
             raise ValidationError("%server_error_invalid_name")
 
         # Make sure the user role is one of the possible roles
@@ -955,10 +1135,19 @@ class API:
             raise ValidationError("%server_error_invalid_role")
 
         # Make sure all types are correct
-        API._dataclass_check_types(u)
+        _check_user_types(u)
 
         return u
 
+    @staticmethod
+    def _user_to_dict(user):
+        """
+        Converts a tivua.database.User object into a dictionary. All fields are
+        immutable scalars, so there is no need for the deep copy performed by
+        dataclasses.asdict.
+        """
+        return {name: getattr(user, name) for name in _USER_FIELDS}
+
     def get_user_list(self, include_credentials=False):
         """
         Returns a list of user objects.
@@ -976,23 +1165,16 @@ class API:
             }
         }
 
+        # If "include_credentials" is set to False, remove confidential
+        # information. This information is only required when an
+        # administrator is managing users. Always remove the password hash.
+        names = (_USER_FIELDS_CREDENTIALS
+                 if include_credentials else _USER_FIELDS_PUBLIC)
+
         # Iterate over the list of users
-        for user in self.db.list_users():
-            user_dict = asdict(user)
-
-            # If "include_credentials" is set to False, remove confidential
-            # information. This information is only required when an
-            # administrator is managing users
-            if not include_credentials:
-                del user_dict["role"]
-                del user_dict["auth_method"]
-                del user_dict["reset_password"]
-
-            # Always remove the password hash from the user dictionary
-            del user_dict["password"]
-
-            # Store the user dictionary in the result
-            res[user.uid] = user_dict
+        res.update((user.uid, {name: getattr(user, name)
+                               for name in names})
+                   for user in self.db.list_users())
         return res
 
     def create_user(self, user_name, display_name="", role="inactive", auth_method="password"):
@@ -1008,21 +1190,22 @@ class API:
             "auth_method": auth_method,
         })
 
-        with Transaction(self.db):
-            # Create a random password for the user and set it
-            password = API.create_random_password()
-            password_hash = self._hash_password(password)
-            user.password = password_hash
+        # Create a random password for the user and set it. Hashing the
+        # password is slow by design; do this outside of the transaction.
+        password = API.create_random_password()
+        user.password = self._hash_password(password)
 
+        with Transaction(self.db):
             # Create the user object in the database, errors are (most likely)
             # only caused by there being a duplicate user name
+            self._user_cache.clear()
             try:
                 user.uid = self.db.create_user(user)
             except UniqueKeyViolationError:
                 raise ConflictError()
 
         # Return the newly created user object
-        return password, asdict(user)
+        return password, API._user_to_dict(user)
 
     def delete_user(self, uid=None, user_name=None, force=False):
         """
@@ -1044,35 +1227,18 @@ class API:
             user = self.db.get_user(uid=uid, user_name=user_name)
             if user is None:
                 raise NotFoundError()
+            self._user_cache.clear()
 
             # Check whether the user has any posts. If yes, either rewrite these
             # posts to the "[deleted]" user (if force=True) or do nothing and
-            # abort (if force=False).
-            def _rewrite(history):
-                # List all the posts for the user
-                filter = FilterUID(user.uid) | FilterAuthor(user.uid)
-                user_posts = self.db.list_posts(history=history, filter=filter)
-
-                # Abort if we found any posts, and "force" is not set
-                if len(user_posts) > 0 and not force:
+            # abort (if force=False). Do this for both the current post table
+            # and the history table.
+            if not force:
+                if self.db.count_user_posts(user.uid, history=None) > 0:
                     return False
-
-                # Otherwise, update the post CUID or MUID to "0" and update the
-                # post
-                for post in user_posts:
-                    if post.cuid == user.uid:
-                        post.cuid = 0
-                    if post.muid == user.uid:
-                        post.muid = 0
-                    if post.author == user.uid:
-                        post.author = 0
-                    self.db.update_post(post, history=history)
-
-                return True
-
-            # Rewrite both the current post table and the history table
-            if not (_rewrite(history=False) and _rewrite(history=True)):
-                return False
+            else:
+                for history in (False, True):
+                    self.db.reassign_user_posts(user.uid, 0, history=history)
 
             # Delete all sessions for this user
             self.db.purge_sessions_for_user(user.uid)
@@ -1111,24 +1277,27 @@ class API:
                     self.db.purge_sessions_for_user(user.uid)
 
                 # Write the user back with the updated role
+                self._user_cache.clear()
                 user.role = role
                 self.db.update_user(user)
 
     def reset_user_password(self, uid=None, user_name=None):
+        # Create a random password. Hashing the password is slow by design; do
+        # this outside of the transaction.
+        password = self.create_random_password()
+        password_hash = self._hash_password(password)
+
         with Transaction(self.db):
             user = self.db.get_user(uid=uid, user_name=user_name)
             if user is None:
                 raise NotFoundError()
 
-            # Create a random password
-            password = self.create_random_password()
-            password_hash = self._hash_password(password)
-
             # Set the password and the reset_password flag
             user.password = password_hash
             user.reset_password = True
 
             # Write the user back to the database
+            self._user_cache.clear()
             self.db.update_user(user)
 
             # Return the generated password for display
@@ -1164,13 +1333,14 @@ class API:
 
             # Coerce the updated user to make sure all new settings adhere to
             # the rules
-            user_new = API.coerce_user(asdict(user))
+            user_new = API._coerce_user_obj(user)
+            self._user_cache.clear()
             try:
                 self.db.update_user(user_new)
             except UniqueKeyViolationError:
                 raise ConflictError()
 
-            return asdict(user_new)
+            return API._user_to_dict(user_new)
 
     ############################################################################
     # Export and import                                                        #
@@ -1184,68 +1354,91 @@ class API:
         with Transaction(self.db):
             # Delete all keywords
             self.db.keywords.clear()
+            self._keyword_cache = None
 
-            # List all posts and construct a mapping between posts and keywords
-            keywords = {}
-            for post in self.db.list_posts():
-                for keyword in API._split(post.keywords):
-                    if keyword in keywords:
-                        keywords[keyword].add(post.pid)
-                    else:
-                        keywords[keyword] = {
-                            post.pid,
-                        }
-
-            # Insert the keywords into the database; the keywords dictionary
-            # is a MultiDict, i.e., it stores a set per keyword
-            for keyword, pids in keywords.items():
-                self.db.keywords[keyword] = pids
+            # Insert a (keyword, pid) pair for each keyword of each post using
+            # a single batched statement. The keywords dictionary is a
+            # MultiDict, i.e., assigning individual pairs adds the pid to the
+            # set stored for the keyword. Since the table was just cleared,
+            # there is no need to aggregate the pids per keyword first.
+            self.db.keywords.update(
+                (keyword, post.pid) for post in self.db.iter_posts()
+                for keyword in API._split(post.keywords))
 
-    def export_to_object(self, export_passwords=False):
+    def _export_tables(self, export_passwords=False):
         """
-        Exports the entire database into a JSON serialisable object. Some tables
-        with volatile data (such as the "cache", "challenges", and "sessions"
-        tables) will not be exported.
+        Returns a list of (name, value) tuples describing the exported tables.
+        Posts and users are returned as generators producing one JSON
+        serialisable dictionary per row. Must be called from within a
+        transaction.
         """
-        with Transaction(self.db):
-            # Export the configuration options
-            config_obj = {}
-            for key, value in self.db.configuration.items():
-                config_obj[key] = value
-
-            # Export the posts
-            posts_arr = []
-            for post in self.db.list_posts():
-                posts_arr.append(asdict(post))
-
-            # Export the post history
-            posts_history_arr = []
-            for post in self.db.list_posts(history=True):
-                posts_history_arr.append(asdict(post))
-
-            # Export the users
-            users_arr = []
+        def _export_posts(history):
+            for post in self.db.iter_posts(history=history):
+                yield dict(zip(_POST_FIELDS, _POST_VALUES(post)))
+
+        def _export_users():
             for user in self.db.list_users():
-                user_obj = asdict(user)
+                user_obj = API._user_to_dict(user)
                 if not export_passwords:
                     user_obj["reset_password"] = True
                     del user_obj["password"]
-                users_arr.append(user_obj)
+                yield user_obj
 
-            # Export the user settings
-            settings_obj = {}
-            for key, value in self.db.settings.items():
-                settings_obj[key] = value
+        return [
+            ("configuration", dict(self.db.configuration.items())),
+            ("posts", _export_posts(history=False)),
+            ("posts_history", _export_posts(history=True)),
+            ("users", _export_users()),
+            ("settings", dict(self.db.settings.items())),
+        ]
 
-            # Return the completely assembled object
+    def export_to_object(self, export_passwords=False):
+        """
+        Exports the entire database into a JSON serialisable object. Some tables
+        with volatile data (such as the "cache", "challenges", and "sessions"
+        tables) will not be exported.
+        """
+        with Transaction(self.db):
             return {
-                "configuration": config_obj,
-                "posts": posts_arr,
-                "posts_history": posts_history_arr,
-                "users": users_arr,
-                "settings": settings_obj
+                name: value if isinstance(value, dict) else list(value)
+                for name, value in self._export_tables(export_passwords)
             }
 
+    def export_to_stream(self, fp, export_passwords=False):
+        """
+        Writes the same data as export_to_object() as indented JSON to the
+        given text file object. The posts and users are serialised one at a
+        time, instead of building the entire object in memory first.
+
+        @param fp is the file object the JSON data should be written to.
+        @param export_passwords if True, includes the password hashes in the
+               exported data.
+        """
+        def _dumps(obj, indent):
+            return json.dumps(obj, indent=4).replace("\n", "\n" + indent)
+
+        with Transaction(self.db):
+            fp.write("{")
+            for i, (name, value) in enumerate(
+                    self._export_tables(export_passwords)):
+                fp.write(",\n    " if i > 0 else "\n    ")
+                fp.write(json.dumps(name) + ": ")
+                if isinstance(value, dict):
+                    fp.write(_dumps(value, " " * 4))
+                    continue
+                fp.write("[")
+                empty = True
+                for row in value:
+                    fp.write("\n        " if empty else ",\n        ")
+                    fp.write(_dumps(row, " " * 8))
+                    empty = False
+                fp.write("]" if empty else "\n    ]")
+            fp.write("\n}")
+
+    # Number of posts that are converted and inserted at once when importing
+    # a backup
+    IMPORT_CHUNK_SIZE = 10000
+
     def import_from_object(self, obj):
         """
         Restors a database backup formerly created by the export_to_json
@@ -1254,6 +1447,11 @@ class API:
         @param obj is a Python object that has been deserialised from JSON
         """
 
+        # The imported configuration may contain a different salt
+        self._salt_cache = None
+        self._config_cache = None
+        self._user_cache.clear()
+
         # Make sure that this operation is atomic
         with Transaction(self.db):
             # Delete everything in the database
@@ -1262,22 +1460,57 @@ class API:
             # Go through all restorable tables (i.e., it doesn't make much sense
             # to backup the challenges, sessions, cache, keywords tables).
             if "configuration" in obj:
-                for key, value in obj["configuration"].items():
-                    self.db.configuration[key] = value
+                self.db.configuration.update(obj["configuration"])
+            # Posts and users are inserted using batched statements. Posts
+            # are converted in chunks, since each chunk is needed twice.
             if "posts" in obj:
-                for post in obj["posts"]:
-                    p = API.coerce_post(post)
-                    self.db.create_post(p)
-                    self.db.update_fulltext(p.pid, p)
+                posts_iter = map(API.coerce_post, obj["posts"])
+                while True:
+                    posts = list(islice(posts_iter, API.IMPORT_CHUNK_SIZE))
+                    if not posts:
+                        break
+                    self.db.create_posts(posts)
+                    self.db.update_fulltext_many((p.pid, p) for p in posts)
             if "posts_history" in obj:
-                for post in obj["posts_history"]:
-                    self.db.create_post(API.coerce_post(post), history=True)
+                self.db.create_posts(
+                    (API.coerce_post(post) for post in obj["posts_history"]),
+                    history=True)
             if "users" in obj:
-                for user in obj["users"]:
-                    self.db.create_user(API.coerce_user(user))
+                self.db.create_users(
+                    API.coerce_user(user) for user in obj["users"])
             if "settings" in obj:
-                for key, value in obj["settings"].items():
-                    self.db.settings[key] = value
+                self.db.settings.update(obj["settings"])
 
             # Rebuild the keywords table
             self._rebuild_keywords()
+
+
+################################################################################
+# SHORTHANDS                                                                   #
+################################################################################
+
+# Bound methods of the regular expressions used in the hot paths of the API.
+# Looking these up once is cheaper than resolving "API.<NAME>_RE.match" on
+# every call.
+_USER_MATCH = API.USER_RE.match
+
+_HEX64_CHARS_SUPERSET = API.HEX64_CHARS.issuperset
+
+
+def _is_hex64(s):
+    """
+    Returns True if the given string is a 32-byte lower-case hex string, such
+    as a session id, challenge, or salt. This is used instead of a regular
+    expression since these identifiers are checked several times per request.
+    """
+    return len(s) == 64 and _HEX64_CHARS_SUPERSET(s)
+
+
+def _decode_hex64(s):
+    """
+    Converts the given 32-byte lower-case hex string into a bytes object.
+    Raises a ValidationError if the string is not valid.
+    """
+    if not _is_hex64(s):
+        raise ValidationError()
+    return bytes.fromhex(s)
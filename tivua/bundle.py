@@ -22,11 +22,117 @@ Contains code for bundling index.html and its resources.
 import os
 import re
 import hashlib
-import multiprocessing
+import concurrent.futures
+
+from tivua.minify import Minify
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Regular expressions used to find the marked style and script elements in the
+# HTML file. The markers are pure ASCII, so the HTML is processed as bytes
+# without decoding it.
+_STYLE_RE = re.compile(
+    rb"<!-- STYLE BEGIN -->(?P<body>.*?)<!-- STYLE END -->", re.DOTALL)
+_SCRIPT_RE = re.compile(
+    rb"<!-- SCRIPT(?P<stub> STUB)? BEGIN -->"
+    rb"(?P<body>.*?)"
+    rb"<!-- SCRIPT(?: STUB)? END -->", re.DOTALL)
+
+# Process-wide memo of the files read by bundle(). Maps a filename onto a list
+# [mtime_ns, size, blob, hash], where the hash is computed lazily. Entries are
+# revalidated using the file's modification time and size, so repeated calls to
+# bundle() only re-read and re-hash files that actually changed.
+_FILE_MEMO = {}
+
+# Maximum number of threads used to read the files referenced in a bundle
+_READ_THREADS = 8
+
+
+def _read_file(filename):
+    """
+    Used internally by bundle() to read the given file. Returns the memoised
+    content if the file was not modified since it was last read.
+    """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        entry = _FILE_MEMO.get(filename)
+        if ((entry is None) or (entry[0] != st.st_mtime_ns)
+                or (entry[1] != st.st_size)):
+            # Read the entire file with as few unbuffered reads as possible
+            chunks, size = [], st.st_size
+            while True:
+                chunk = os.read(fd, max(size, 65536))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size -= len(chunk)
+            entry = [st.st_mtime_ns, st.st_size, b"".join(chunks), None]
+            _FILE_MEMO[filename] = entry
+        return entry[2]
+    finally:
+        os.close(fd)
+
+
+def _hash_blob(filename, blob):
+    """
+    Returns the SHA-256 hex digest of the given blob. Reuses the digest stored
+    in the file memo if the blob is the memoised content of the given file.
+    """
+    entry = _FILE_MEMO.get(filename)
+    if (entry is None) or (not entry[2] is blob):
+        return hashlib.sha256(blob).hexdigest()
+    if entry[3] is None:
+        entry[3] = hashlib.sha256(blob).hexdigest()
+    return entry[3]
+
+
+def _iter_attr(block, tag, attr, ext):
+    """
+    Used internally by bundle() to extract the files referenced in a marked
+    block. Yields the value of the given attribute of each element with the
+    given tag name, provided that the value ends with the given extension. The
+    content of the marked blocks is under our control, so a simple scan using
+    bytes.find() suffices.
+
+    @param block is the content of the marked block.
+    @param tag is the tag name including the opening bracket, e.g. b"<link".
+    @param attr is the attribute name including the quote, e.g. b"href=\"".
+    @param ext is the required file extension, e.g. b".css".
+    """
+    i = block.find(tag)
+    while i >= 0:
+        j = block.find(attr, i + len(tag))
+        if j < 0:
+            return
+        j += len(attr)
+        k = block.find(b"\"", j)
+        if k < 0:
+            return
+        if block.endswith(ext, j, k):
+            yield block[j:k]
+        i = block.find(tag, k + 1)
+
+
+def _cache_lookup(cache, keys):
+    """
+    Used internally by bundle() to look up the given keys in the minification
+    cache. Uses a single query if the cache is a database dictionary. Returns
+    a dictionary containing the keys that were found.
+    """
+    if cache is None:
+        return {}
+    if hasattr(cache, "lookup_many"):
+        return cache.lookup_many(keys)
+    res = {}
+    for key in keys:
+        try:
+            res[key] = cache[key]
+        except KeyError:
+            pass
+    return res
+
 
 def bundle(filename, cache=None, do_bundle=True, do_minify=True, do_exclude_stub=True):
     """
@@ -44,8 +150,13 @@ def bundle(filename, cache=None, do_bundle=True, do_minify=True, do_exclude_stub
            source.
     """
 
+    # Thread pool used for minification. The minifiers are external programs,
+    # so threads merely wait for the subprocesses to finish. Created on demand
+    # and shared between all bundles generated by this function call.
+    pool = None
+
     def add_bundle(res, name, ext, data, filenames):
-        from tivua.minify import Minify
+        nonlocal pool
 
         # Minify the bundle
         minifier = getattr(Minify, ext)
@@ -54,12 +165,24 @@ def bundle(filename, cache=None, do_bundle=True, do_minify=True, do_exclude_stub
             bundle_data = b'\n'.join(data)
         else:
             # Check whether the minified version is already stored in the cache
-            bundle_data, bundle_data_min_idx = [], []
+            bundle_data, bundle_data_min_idx = [None] * len(data), []
+            min_suffix, hashes = ".min." + ext, []
             for i, blob in enumerate(data):
-                hash = hashlib.sha256(blob).hexdigest()
-                if (not cache is None) and (hash in cache):
+                # Files that are already minified are included as they are
+                if filenames[i].endswith(min_suffix):
+                    logger.debug("File \"{}\" is already minified".format(filenames[i]))
+                    bundle_data[i] = blob
+                    continue
+
+                hashes.append((i, _hash_blob(filenames[i], blob)))
+
+            # Look up all hashes at once; the cache may be backed by the
+            # database
+            cached = _cache_lookup(cache, [hash for _, hash in hashes])
+            for i, hash in hashes:
+                if not cached.get(hash) is None:
                     logger.debug("Using cached minified version of file \"{}\"".format(filenames[i]))
-                    bundle_data.append(cache[hash])
+                    bundle_data[i] = cached[hash]
                 else:
                     logger.debug("Queuing file \"{}\" for minification".format(filenames[i]))
                     bundle_data_min_idx.append((i, hash))
@@ -67,18 +190,23 @@ def bundle(filename, cache=None, do_bundle=True, do_minify=True, do_exclude_stub
             # Minify all the blobs that need to be minified
             if len(bundle_data_min_idx):
                 logger.info("Minifying updated {} files. This may take a while...".format(ext.upper()))
-            with multiprocessing.Pool() as pool:
+                if pool is None:
+                    pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=os.cpu_count() or 1)
+
                 # Select the subset of blobs that need to be minified and then
-                # minify them
-                data = [data[i] for i, hash in bundle_data_min_idx]
-                data = pool.map(minifier, data)
-
-                # Insert the minified elements into the cache and into the right
-                # place in the bundle
-                for j, (i, hash) in enumerate(bundle_data_min_idx):
-                    bundle_data.insert(i, data[j])
+                # minify them. Insert the minified elements into the cache and
+                # into the right place in the bundle as soon as they are
+                # available.
+                futures = {
+                    pool.submit(minifier, data[i]): (i, hash)
+                    for i, hash in bundle_data_min_idx
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    i, hash = futures[future]
+                    bundle_data[i] = blob = future.result()
                     if not cache is None:
-                        cache[hash] = data[j]
+                        cache[hash] = blob
 
             # Concatenate all minified blobs into a single file
             bundle_data = b'\n'.join(bundle_data)
@@ -104,79 +232,87 @@ def bundle(filename, cache=None, do_bundle=True, do_minify=True, do_exclude_stub
         }
         return bundle_filename
 
-    # Extract the file extension, name, and path from the given filename
-    get_ext = lambda s: (".".join(s.split(".")[:-1]), s.split(".")[-1])
-    html_name, html_ext = get_ext(os.path.basename(filename))
-    html_path = os.path.dirname(filename)
+    def read_files(filenames):
+        # Reading files is I/O bound, so issue the reads from a few threads
+        if len(filenames) <= 1:
+            return list(map(_read_file, filenames))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(_READ_THREADS, len(filenames))) as tp:
+            return list(tp.map(_read_file, filenames))
 
-    # Read the html file
-    with open(filename, "rb") as f:
-        html = str(f.read(), "utf-8")
+    try:
+        # Extract the name and path from the given filename
+        html_name = os.path.splitext(os.path.basename(filename))[0]
+        html_path = os.path.dirname(filename)
 
-    # Initialise the result dictionary containing the compressed files
-    res = {}
-    html_replacements = {}
-
-    # Replace all marked style elementsfile:///home/andreas/source/tivua/static/
-    style_re1 = re.compile(r"<!-- STYLE BEGIN -->(.*?)<!-- STYLE END -->",
-                           re.DOTALL)
-    style_re2 = re.compile(r"<link.*?href=\"(.*?.css)\"", re.DOTALL)
-    for mrange in re.findall(style_re1, html):
-        # Bundle the CSS
-        if not do_bundle:
-            continue
-        css_data, css_filenames = [], []
-        for mhref in re.finditer(style_re2, mrange):
-            css_filename = os.path.join(html_path, mhref[1])
-            with open(css_filename, "rb") as f:
-                css_data.append(f.read())
-                css_filenames.append(css_filename)
+        # Read the html file
+        html = _read_file(filename)
 
-        # Add the bundled file to the result array
-        bundle_filename = add_bundle(res, html_name, "css", css_data, css_filenames)
-
-        # Reference the bundled/minified JS in the HTML
-        html_replacements[
-            mrange] = "<link rel=\"stylesheet\" href=\"" + bundle_filename + "\" />"
-
-    # Replace all marked script elements
-    script_re1 = re.compile(
-        r"<!-- SCRIPT( STUB)? BEGIN -->(.*?)<!-- SCRIPT( STUB)? END -->",
-        re.DOTALL)
-    script_re2 = re.compile(r"<script.*?src=\"(.*?.js)\"", re.DOTALL)
-    for mrange in re.findall(script_re1, html):
-        # Skip the script stub if requested
-        is_stub = bool(mrange[0])
-        if is_stub and do_exclude_stub:
-            html_replacements[mrange[1]] = ""
-            continue
-
-        # Bundle the JS
-        if not do_bundle:
-            continue
-        js_data, js_filenames = [], []
-        for mhref in re.finditer(script_re2, mrange[1]):
-            js_filename = os.path.join(html_path, mhref[1])
-            with open(js_filename, "rb") as f:
-                js_data.append(f.read())
-                js_filenames.append(js_filename)
+        # Initialise the result dictionary containing the compressed files
+        res = {}
 
-        # Add the bundled file to the result array
-        bundle_filename = add_bundle(res, html_name, "js", js_data, js_filenames)
+        # List of (start, end, replacement) tuples describing the ranges in the
+        # HTML file that should be replaced
+        html_replacements = []
+
+        # Replace all marked style elementsfile:///home/andreas/source/tivua/static/
+        for mstyle in _STYLE_RE.finditer(html):
+            # Bundle the CSS
+            if not do_bundle:
+                continue
+            css_filenames = [
+                os.path.join(html_path, str(href, "utf-8"))
+                for href in _iter_attr(mstyle["body"], b"<link", b"href=\"", b".css")]
+            css_data = read_files(css_filenames)
+
+            # Add the bundled file to the result array
+            bundle_filename = add_bundle(res, html_name, "css", css_data, css_filenames)
+
+            # Reference the bundled/minified JS in the HTML
+            html_replacements.append(mstyle.span("body") + (
+                b"<link rel=\"stylesheet\" href=\"" + bundle_filename.encode("utf-8") + b"\" />", ))
+
+        # Replace all marked script elements
+        for mscript in _SCRIPT_RE.finditer(html):
+            # Skip the script stub if requested
+            is_stub = bool(mscript["stub"])
+            if is_stub and do_exclude_stub:
+                html_replacements.append(mscript.span("body") + (b"", ))
+                continue
+
+            # Bundle the JS
+            if not do_bundle:
+                continue
+            js_filenames = [
+                os.path.join(html_path, str(src, "utf-8"))
+                for src in _iter_attr(mscript["body"], b"<script", b"src=\"", b".js")]
+            js_data = read_files(js_filenames)
+
+            # Add the bundled file to the result array
+            bundle_filename = add_bundle(res, html_name, "js", js_data, js_filenames)
 
-        # Reference the bundled/minified JS in the HTML
-        html_replacements[
-            mrange[1]] = "<script src=\"" + bundle_filename + "\"" + (
-                "" if is_stub else " defer") + "></script>"
+            # Reference the bundled/minified JS in the HTML
+            html_replacements.append(mscript.span("body") + (
+                b"<script src=\"" + bundle_filename.encode("utf-8") + b"\"" + (
+                    b"" if is_stub else b" defer") + b"></script>", ))
 
-    # Apply all replacements
-    for old, new in html_replacements.items():
-        html = html.replace(old, new)
+        # Apply all replacements in a single pass over the HTML
+        html_parts, pos = [], 0
+        for start, end, replacement in sorted(html_replacements):
+            html_parts.append(html[pos:start])
+            html_parts.append(replacement)
+            pos = end
+        html_parts.append(html[pos:])
+        html = b"".join(html_parts)
 
-    # Minify the resulting HTML
-    bundle_filename = add_bundle(res, html_name, "html",
-                                 [html.encode("utf-8")], [filename])
-    return bundle_filename, res
+        # Minify the resulting HTML
+        bundle_filename = add_bundle(res, html_name, "html",
+                                     [html], [filename])
+        return bundle_filename, res
+    finally:
+        # Stop the minification worker threads, if any were started
+        if not pool is None:
+            pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -25,7 +25,11 @@ database calls. These operations are performed by the API class.
 @author Andreas Stöckel
 """
 
+import re
+import time
+import calendar
 import sqlite3
+import itertools
 
 from tivua.database_dictionary import make_database_dict_class
 from tivua.database_transaction import Transaction
@@ -41,7 +45,8 @@ logger = logging.getLogger(__name__)
 # DATA CLASSES                                                                 #
 ################################################################################
 
-from dataclasses import dataclass, asdict, astuple
+from dataclasses import dataclass, fields
+from operator import attrgetter
 
 @dataclass(order=True)
 class Post:
@@ -68,6 +73,15 @@ class User:
     reset_password: bool = True
 
 
+# Accessors converting a Post or User instance into a tuple of column values.
+# In contrast to dataclasses.astuple(), these do not deep-copy the fields. The
+# "update" variants move the primary key to the end for use in a WHERE clause.
+_post_as_tuple = attrgetter(*(f.name for f in fields(Post)))
+_post_as_update_tuple = attrgetter(*(f.name for f in fields(Post)[1:]), "pid")
+_user_as_tuple = attrgetter(*(f.name for f in fields(User)))
+_user_as_update_tuple = attrgetter(*(f.name for f in fields(User)[1:]), "uid")
+
+
 ################################################################################
 # DATABASE CLASS                                                               #
 ################################################################################
@@ -78,6 +92,16 @@ class SchemaOutOfDateError(RuntimeError):
 class UniqueKeyViolationError(RuntimeError):
     pass
 
+def _post_table_sql(sql):
+    """
+    Instantiates the given SQL template for both the "posts" and the
+    "posts_history" table. Returns a dictionary mapping the "history" flag
+    accepted by the post-related methods onto the corresponding statement.
+    Using the same string objects for each call allows the sqlite3 statement
+    cache to be hit without formatting the SQL every time.
+    """
+    return {False: sql.format("posts"), True: sql.format("posts_history")}
+
 class Database:
     """
     The Database class manages the SQLite database in which all Tivua posts and
@@ -179,6 +203,22 @@ class Database:
     ConfigurationDict = make_database_dict_class("configuration")
     SettingsDict = make_database_dict_class("settings", "uid", "obj")
 
+    # Regular expression used to canonicalise whitespace in SQL statements
+    _CANONICAL_WS_RE = re.compile(r"\s+")
+
+    @staticmethod
+    def _canonicalise_sql(sql):
+        """
+        Collapses all whitespace in the given SQL statement into single spaces.
+        """
+        return Database._CANONICAL_WS_RE.sub(" ", sql).strip()
+
+    # Number of prepared statements cached by the sqlite3 module. Apart from
+    # filter queries, all SQL used by the Database class and the dictionaries
+    # consists of constant strings; the cache is large enough to keep all of
+    # them prepared.
+    CACHED_STATEMENTS = 256
+
     def __init__(self, filename=":memory:"):
         """
         Creates the Database object, does not open the database yet -- this can
@@ -201,13 +241,13 @@ class Database:
 
         # Open the database with isolation_level=None, which disables the commit
         # logic of the Python wrapper
-        self.conn = sqlite3.connect(self.filename, isolation_level=None)
+        self.conn = sqlite3.connect(self.filename, isolation_level=None,
+                                    cached_statements=Database.CACHED_STATEMENTS)
 
         # Prepate the database for first-time use
         self._configure_db()
         self._create_tables()
         self._create_indices()
-        self._create_functions()
 
         return self
 
@@ -217,6 +257,13 @@ class Database:
         """
         logger.debug("Closing database file \"{}\"".format(self.filename))
 
+        # Update the query planner statistics gathered during this session.
+        # This must never prevent the connection from being closed.
+        try:
+            self.conn.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            logger.exception("Error while optimising the database")
+
         # Closes the connection
         self.conn.close()
         self.conn = None
@@ -228,26 +275,32 @@ class Database:
         c = self.conn.cursor()
         c.execute("PRAGMA journal_mode=WAL")
 
+        # In WAL mode, synchronous=NORMAL still guarantees consistency, but only
+        # syncs the WAL during checkpoints instead of on every commit
+        c.execute("PRAGMA synchronous=NORMAL")
+
+        # Keep temporary tables and indices in memory, allow up to 64 MiB of
+        # page cache, and memory-map up to 256 MiB of the database file
+        c.execute("PRAGMA temp_store=MEMORY")
+        c.execute("PRAGMA cache_size=-65536")
+        c.execute("PRAGMA mmap_size=268435456")
+
     def _create_tables(self):
         """
         Makes sure all tables exists and have the right version. Raises an
         exception if there is a mismatch between the current DB schema and the
         DB schema used in the Database.
         """
-        import re
-
+        # Fetch the schemas of all existing tables using a single query
         c = self.conn.cursor()
-        canonicalise_whitespace = re.compile(r"\s+")
+        existing = dict(
+            c.execute("SELECT name, sql FROM sqlite_master WHERE type='table'"))
         for table, sql in Database.SQL_TABLES.items():
-            # Remove superfluous whitespace characters
-            sql = canonicalise_whitespace.sub(sql, " ")
-            c.execute("SELECT sql FROM sqlite_master WHERE tbl_name=?",
-                      (table, ))
-            res = c.fetchone()
-            if res is None:
+            if not table in existing:
                 logger.debug("Creating table \"{}\"".format(table))
                 c.execute(sql)
-            elif canonicalise_whitespace.sub(res[0], " ") != sql:
+            elif (Database._canonicalise_sql(existing[table]) !=
+                  Database._SQL_TABLES_CANONICAL[table]):
                 raise SchemaOutOfDateError(
                     ("Table \"{}\" is out of date. Please upgrade to a new " +
                      "database by exporting your current database using the " +
@@ -263,21 +316,67 @@ class Database:
                 """CREATE INDEX IF NOT EXISTS posts_date_index ON posts(date DESC)"""
             )
             t.execute(
-                """CREATE INDEX IF NOT EXISTS posts_pid_index ON posts(pid)""")
+                """CREATE INDEX IF NOT EXISTS users_role_index ON users(role)""")
+            t.execute(
+                """CREATE INDEX IF NOT EXISTS sessions_mtime_index ON sessions(mtime)"""
+            )
+            t.execute(
+                """CREATE INDEX IF NOT EXISTS sessions_uid_index ON sessions(uid)""")
             t.execute(
-                """CREATE INDEX IF NOT EXISTS keywords_keyword_index ON keywords(keyword ASC)"""
+                """CREATE INDEX IF NOT EXISTS challenges_ctime_index ON challenges(ctime)"""
             )
 
+            # Drop indices created by earlier versions that duplicate implicit
+            # indices: "pid" is an alias of the rowid of the "posts" table, and
+            # "keyword" is the prefix of the unique (keyword, pid) constraint.
+            # Redundant indices only slow down writes.
+            t.execute("""DROP INDEX IF EXISTS posts_pid_index""")
+            t.execute("""DROP INDEX IF EXISTS keywords_keyword_index""")
+
+    def maintenance(self, initial=False):
+        """
+        Updates the query planner statistics if SQLite deems this worthwhile.
+        This should be called periodically for long-lived connections.
+
+        @param initial if True, additionally requests SQLite to check all
+               tables; this should be set for the first call on a long-lived
+               connection.
+        """
+        if initial:
+            self.conn.execute("PRAGMA optimize=0x10002")
+        else:
+            self.conn.execute("PRAGMA optimize")
+
     @property
     def open(self):
         return self.conn != None
 
+    def _fetchone(self, sql, params=(), D=None):
+        """
+        Executes a single read-only statement and returns the first resulting
+        row, or None if there is no such row. If a dataclass D is given, the row
+        is converted into an instance of D. A single statement is atomic by
+        itself and sees the changes made by the current transaction, so there
+        is no need to wrap it in a Transaction (i.e., a SAVEPOINT).
+        """
+        row = self.conn.execute(sql, params).fetchone()
+        if (row is None) or (D is None):
+            return row
+        return D(*row)
+
+    def data_version(self):
+        """
+        Returns an integer that changes whenever another connection commits
+        changes to the database. Changes made through this connection do not
+        affect the returned value. This can be used to invalidate caches.
+        """
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
     @staticmethod
     def now():
         """
         Returns an integer corresponding to the current Unix timestamp.
         """
-        import time
         return int(time.time())
 
     @staticmethod
@@ -285,31 +384,13 @@ class Database:
         """
         Returns a Unix timestamp corresponding to noon, today, in UTC.
         """
-        from datetime import date, datetime, timezone
-
-        # Fetch today's date
-        today = date.today()
+        # Fetch today's (local) date
+        today = time.localtime()
 
         # Create a new UNIX timestamp pointing at the same date as today, but
         # at noon, UTC.
-        return int(
-            datetime(
-                today.year,
-                today.month,
-                today.day,
-                12,
-                0,
-                0,
-                0,
-                tzinfo=timezone.utc).timestamp())
-
-    def _create_functions(self):
-        """
-        Registers the now() function -- this function returns the current Unix
-        timestamp.
-        """
-
-        self.conn.create_function("now", 0, Database.now)
+        return calendar.timegm(
+            (today.tm_year, today.tm_mon, today.tm_mday, 12, 0, 0))
 
     def purge(self):
         """
@@ -351,9 +432,22 @@ class Database:
         """
         Deletes challenges older than the specified maximum age.
         """
+        # Compute the cutoff time once instead of comparing the age of every
+        # row; this allows SQLite to use an index on the ctime column
         with Transaction(self) as t:
-            t.execute("DELETE FROM challenges WHERE now() - ctime > ?",
-                      (max_age, ))
+            t.execute("DELETE FROM challenges WHERE ctime < ?",
+                      (Database.now() - max_age, ))
+            return t.rowcount > 0
+
+    def consume_challenge(self, challenge, max_age):
+        """
+        Deletes the given challenge. Returns True if the challenge existed and
+        was not older than the specified maximum age.
+        """
+        with Transaction(self) as t:
+            t.execute("""DELETE FROM challenges
+                         WHERE challenge = ? AND ctime >= ?""",
+                      (challenge, Database.now() - max_age))
             return t.rowcount > 0
 
     ############################################################################
@@ -365,8 +459,8 @@ class Database:
         Delete sessions older than the specified maximum age.
         """
         with Transaction(self) as t:
-            t.execute("DELETE FROM sessions WHERE now() - mtime > ?",
-                      (max_age, ))
+            t.execute("DELETE FROM sessions WHERE mtime < ?",
+                      (Database.now() - max_age, ))
             return t.rowcount > 0
 
     def purge_sessions_for_user(self, uid):
@@ -383,8 +477,8 @@ class Database:
         """
         with Transaction(self) as t:
             t.execute(
-                "INSERT INTO sessions(sid, uid, mtime) VALUES (?, ?, now())",
-                (sid, uid))
+                "INSERT INTO sessions(sid, uid, mtime) VALUES (?, ?, ?)",
+                (sid, uid, Database.now()))
 
     def delete_session(self, sid):
         """
@@ -394,13 +488,21 @@ class Database:
             t.execute("DELETE FROM sessions WHERE sid = ?", (sid, ))
             return t.rowcount > 0
 
-    def update_session_mtime(self, sid):
+    def update_session_mtime(self, sid, max_age=None):
         """
-        Advances the modification time for the given session id.
+        Advances the modification time for the given session id. Returns False
+        if the session does not exist. If max_age is given, sessions older than
+        the specified maximum age are treated as non-existent.
         """
+        now = Database.now()
         with Transaction(self) as t:
-            t.execute("UPDATE sessions SET mtime = now() WHERE sid = ?",
-                      (sid, ))
+            if max_age is None:
+                t.execute("UPDATE sessions SET mtime = ? WHERE sid = ?",
+                          (now, sid))
+            else:
+                t.execute("""UPDATE sessions SET mtime = ?
+                             WHERE sid = ? AND mtime >= ?""",
+                          (now, sid, now - max_age))
             return t.rowcount > 0
 
     def get_session_uid(self, sid):
@@ -408,9 +510,18 @@ class Database:
         Returns the uid associated with the given session or -1 if the session
         does not exist.
         """
-        with Transaction(self) as t:
-            t.execute("SELECT uid FROM sessions WHERE sid = ?", (sid, ))
-            return t.fetchone()[0]
+        row = self._fetchone("SELECT uid FROM sessions WHERE sid = ?", (sid, ))
+        return None if row is None else row[0]
+
+    def get_session_user(self, sid):
+        """
+        Returns an object describing the user associated with the given session
+        or None if either the session or the user does not exist.
+        """
+        return self._fetchone("""SELECT users.* FROM sessions
+                                 JOIN users ON users.uid = sessions.uid
+                                 WHERE sessions.sid = ? LIMIT 1""", (sid, ),
+                              User)
 
     ############################################################################
     # User management                                                          #
@@ -426,23 +537,36 @@ class Database:
                     """
                     INSERT INTO users
                     (uid, name, display_name, role, auth_method, password, reset_password)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)""", astuple(user))
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""", _user_as_tuple(user))
             except sqlite3.IntegrityError:
                 raise UniqueKeyViolationError()
             return t.lastrowid
 
-    def update_user(self, user):
+    def create_users(self, users):
+        """
+        Creates all users in the given iterable using a single batched
+        statement. In contrast to create_user(), the ids of the created users
+        are not returned; this is mostly useful when restoring a backup.
+        """
         with Transaction(self) as t:
-            # Convert the user to a tuple
-            user = astuple(user)
+            try:
+                t.executemany(
+                    """
+                    INSERT INTO users
+                    (uid, name, display_name, role, auth_method, password, reset_password)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""", map(_user_as_tuple, users))
+            except sqlite3.IntegrityError:
+                raise UniqueKeyViolationError()
 
+    def update_user(self, user):
+        with Transaction(self) as t:
             # Update the user row
             try:
                 t.execute(
                     """
                     UPDATE users SET name=?, display_name=?, role=?, auth_method=?,
                                     password=?, reset_password=?
-                                WHERE uid=?""", user[1:] + (user[0],))
+                                WHERE uid=?""", _user_as_update_tuple(user))
             except sqlite3.IntegrityError:
                 raise UniqueKeyViolationError()
             return t.lastrowid
@@ -459,12 +583,21 @@ class Database:
         """
         Returns a table containing information about all users.
         """
-        with Transaction(self) as t:
+        with Transaction(self, readonly=True) as t:
             t.execute("""SELECT uid, name, display_name, role, auth_method,
                                 password, reset_password
                          FROM users ORDER BY uid""")
             return t.fetchall_dataclass(User)
 
+    def get_admin_user(self):
+        """
+        Returns the user with the smallest uid that is either named "admin" or
+        has the "admin" role, or None if no such user exists.
+        """
+        return self._fetchone("""SELECT * FROM users
+                                 WHERE name='admin' OR role='admin'
+                                 ORDER BY uid LIMIT 1""", (), User)
+
     def get_user(self, user_name=None, uid=None):
         # Make sure that exactly either the uid or the user name is given
         assert (uid is None) != (user_name is None)
@@ -480,10 +613,8 @@ class Database:
         Returns an object describing the user with the given user_name, or None
         if the user does not exist.
         """
-        with Transaction(self) as t:
-            t.execute("""SELECT * FROM users WHERE name=? LIMIT 1""",
-                      (user_name, ))
-            return t.fetchone_dataclass(User)
+        return self._fetchone("""SELECT * FROM users WHERE name=? LIMIT 1""",
+                              (user_name, ), User)
 
     def get_user_by_id(self, uid):
         """
@@ -492,26 +623,37 @@ class Database:
         """
 
         # Fetch the corresponding row from the DB
-        with Transaction(self) as t:
-            t.execute("""SELECT * FROM users WHERE uid=? LIMIT 1""",
-                      (int(uid), ))
-            return t.fetchone_dataclass(User)
+        return self._fetchone("""SELECT * FROM users WHERE uid=? LIMIT 1""",
+                              (int(uid), ), User)
 
     ############################################################################
     # Posts                                                                    #
     ############################################################################
 
+    _SQL_LIST_POSTS = _post_table_sql(
+        """SELECT * FROM {} ORDER BY date DESC LIMIT ? OFFSET ?""")
+
+    _SQL_INSERT_POST = _post_table_sql(
+        """INSERT INTO {}(pid, revision, author, content, keywords,
+                          date, ctime, cuid, mtime, muid)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""")
+
+    _SQL_DELETE_POST = _post_table_sql("""DELETE FROM {} WHERE pid=?""")
+
+    _SQL_UPDATE_POST = _post_table_sql(
+        """UPDATE {} SET revision=?, author=?, content=?, keywords=?,
+                         date=?, ctime=?, cuid=?, mtime=?, muid=?
+           WHERE pid=?""")
+
     def list_posts(self, start=0, limit=-1, history=False, filter=None):
         """
         Lists the newest revision of each post, ordered by date.
         """
-        with Transaction(self) as t:
+        with Transaction(self, readonly=True) as t:
             # Assemble the SQL and corresponding parameter, depending on whether
             # a filter was given or not
-            table = "posts_history" if history else "posts"
             if filter is None:
-                sql = """SELECT * FROM {} ORDER BY date DESC
-                         LIMIT ? OFFSET ?""".format(table)
+                sql = Database._SQL_LIST_POSTS[bool(history)]
                 params = (limit, start)
             else:
                 # Fetch the keys we would like to read
@@ -541,11 +683,22 @@ class Database:
             return t.fetchall_dataclass(Post)
 
 
+    def iter_posts(self, history=False):
+        """
+        Returns an iterator over all posts, ordered by date. In contrast to
+        list_posts(), the rows are fetched and converted into Post instances
+        while iterating. The iterator uses its own cursor and should be
+        consumed from within a transaction.
+        """
+        return itertools.starmap(
+            Post,
+            self.conn.execute(Database._SQL_LIST_POSTS[bool(history)], (-1, 0)))
+
     def total_post_count(self, filter=None):
         """
         Counts the total number of posts of a certain id.
         """
-        with Transaction(self) as t:
+        with Transaction(self, readonly=True) as t:
             if filter is None:
                 t.execute("""SELECT COUNT() FROM posts""")
             else:
@@ -558,74 +711,122 @@ class Database:
 
     def create_post(self, post, history=False):
         with Transaction(self) as t:
-            table = "posts_history" if history else "posts"
-            t.execute(
-            """INSERT INTO {}(pid, revision, author, content, keywords,
-                              date, ctime, cuid, mtime, muid)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""".format(table), astuple(post))
+            t.execute(Database._SQL_INSERT_POST[bool(history)],
+                      _post_as_tuple(post))
             return t.lastrowid
 
+    def create_posts(self, posts, history=False):
+        """
+        Creates all posts in the given iterable using a single batched
+        statement. In contrast to create_post(), the ids of the created posts
+        are not returned; this is mostly useful when restoring a backup.
+        """
+        with Transaction(self) as t:
+            t.executemany(Database._SQL_INSERT_POST[bool(history)],
+                          map(_post_as_tuple, posts))
+
     def delete_post(self, pid, history=False):
         with Transaction(self) as t:
-            table = "posts_history" if history else "posts"
-            t.execute("""DELETE FROM {} WHERE pid=?""".format(table), (pid,))
+            t.execute(Database._SQL_DELETE_POST[bool(history)], (pid,))
             return t.lastrowid
 
     def update_post(self, post, history=False):
         with Transaction(self) as t:
-            # Convert the post to a tuple
-            post = astuple(post)
-
-            # Select the correct target table
-            table = "posts_history" if history else "posts"
-
-            # Execute the update
-            t.execute(
-            """UPDATE {} SET revision=?, author=?, content=?, keywords=?,
-                             date=?, ctime=?, cuid=?, mtime=?, muid=?
-               WHERE pid=?""".format(table), post[1:] + (post[0],))
+            t.execute(Database._SQL_UPDATE_POST[bool(history)],
+                      _post_as_update_tuple(post))
             return t.rowcount > 0
 
     def get_post(self, pid):
         """
         Returns the post with the given pid.
         """
+        return self._fetchone("""SELECT * FROM posts WHERE pid = ? LIMIT 1""",
+                              (pid, ), Post)
+
+    # Columns in the post tables that reference a user id
+    POST_USER_COLUMNS = ("cuid", "muid", "author")
+
+    # Condition selecting all posts that reference a certain user
+    _SQL_POST_USER_COND = " OR ".join(
+        "{}=?".format(col) for col in POST_USER_COLUMNS)
+
+    # Queries counting the posts referencing a certain user. The "None" entry
+    # sums over both the current post table and the history table.
+    _SQL_COUNT_USER_POSTS = _post_table_sql(
+        "SELECT COUNT() FROM {} WHERE " + _SQL_POST_USER_COND)
+    _SQL_COUNT_USER_POSTS[None] = "SELECT ({}) + ({})".format(
+        _SQL_COUNT_USER_POSTS[False], _SQL_COUNT_USER_POSTS[True])
+
+    # Queries replacing a user id in all columns referencing a user
+    _SQL_REASSIGN_USER_POSTS = _post_table_sql(
+        "UPDATE {} SET " + ", ".join(
+            col + " = CASE WHEN " + col + "=? THEN ? ELSE " + col + " END"
+            for col in POST_USER_COLUMNS) + " WHERE " + _SQL_POST_USER_COND)
+
+    def count_user_posts(self, uid, history=False):
+        """
+        Counts the posts that were created, modified, or authored by the user
+        with the given uid. If history is None, counts the rows in both the
+        current post table and the history table using a single query.
+        """
+        n_params = len(Database.POST_USER_COLUMNS)
+        if history is None:
+            n_params *= 2
+        else:
+            history = bool(history)
+        with Transaction(self, readonly=True) as t:
+            t.execute(Database._SQL_COUNT_USER_POSTS[history],
+                      (uid, ) * n_params)
+            return t.fetchone()[0]
+
+    def reassign_user_posts(self, uid, new_uid, history=False):
+        """
+        Replaces the given uid with new_uid in the creator, modifier, and author
+        columns of all posts using a single statement. Returns the number of
+        updated rows.
+        """
+        n_cols = len(Database.POST_USER_COLUMNS)
         with Transaction(self) as t:
-            t.execute("""SELECT * FROM posts WHERE pid = ? LIMIT 1""", (pid, ))
-            return t.fetchone_dataclass(Post)
+            t.execute(Database._SQL_REASSIGN_USER_POSTS[bool(history)],
+                      (uid, new_uid) * n_cols + (uid, ) * n_cols)
+            return t.rowcount
 
     ############################################################################
     # Posts full text search                                                   #
     ############################################################################
 
-    def update_fulltext(self, pid, content):
+    @staticmethod
+    def _fulltext_content(content):
         """
-        Updates or creates the post fulltext search index for the post with the
-        given pid.
+        If a Post object is given as content, generates the corresponding
+        searchable string. Otherwise, returns the content as is.
         """
-
-        # If a Post object is given as content, generate the corresponding
-        # searchable string
         if isinstance(content, Post):
             keywords = ""
             if content.keywords:
-                keywords = " " + " ".join(content.keywords.split(","))
+                keywords = " " + content.keywords.replace(",", " ")
             content = content.content + keywords
+        return content
 
+    def update_fulltext(self, pid, content):
+        """
+        Updates or creates the post fulltext search index for the post with the
+        given pid.
+        """
+        self.update_fulltext_many(((pid, content), ))
+
+    def update_fulltext_many(self, items):
+        """
+        Updates or creates the post fulltext search index for all (pid, content)
+        pairs in the given iterable using a single batched statement. As in
+        update_fulltext(), content may either be a string or a Post object.
+        """
         with Transaction(self) as t:
-            # Check whether there already is some fulltext stored for the given
-            # row id
-            t.execute("SELECT TRUE FROM fulltext WHERE rowid = ?", (pid,))
-            if t.fetchone()[0]:
-                # If yes, just update the fulltext
-                t.execute("""UPDATE fulltext
-                                    SET content=? WHERE rowid = ?""",
-                                    (content, pid,))
-            else:
-                # Otherwise insert a new entry
-                t.execute("""INSERT INTO fulltext(rowid, content)
-                                    VALUES (?, ?)""",
-                                    (pid, content,))
+            t.executemany(
+                """INSERT OR REPLACE INTO fulltext(rowid, content)
+                   VALUES (?, ?)""",
+                ((pid, Database._fulltext_content(content))
+                 for pid, content in items))
 
     def delete_fulltext(self, pid):
         """
@@ -642,12 +843,20 @@ class Database:
         Note: This function is mostly used for testing, the API usually uses
               filters for filtering for posts.
         """
-        with Transaction(self) as t:
+        with Transaction(self, readonly=True) as t:
             t.execute("""SELECT rowid FROM fulltext
                                       WHERE content MATCH ?""", (query,))
             return list(map(lambda x: x[0], t.fetchall()))
 
 
+# Canonical form of the table schemas, compared against the schemas stored in
+# an existing database by Database._create_tables()
+Database._SQL_TABLES_CANONICAL = {
+    table: Database._canonicalise_sql(sql)
+    for table, sql in Database.SQL_TABLES.items()
+}
+
+
 ################################################################################
 # EXPORTS                                                                      #
 ################################################################################
@@ -26,6 +26,8 @@ to provide key-value stores with a dict-like interface.
 # PUBLIC INTERFACE                                                             #
 ################################################################################
 
+from itertools import islice
+
 from tivua.database_transaction import Transaction
 
 
@@ -46,6 +48,15 @@ def make_database_dict_class(table, key="key", value="value", multidict=False):
     else:
         _sql_lookup = "SELECT {} FROM {} WHERE {} = ? LIMIT 1".format(v, t, k)
 
+    # Query for looking up multiple elements at once; "{}" is replaced by a
+    # list of placeholders. Keys are looked up in chunks to stay below the
+    # maximum number of host parameters (999 in older SQLite versions).
+    _lookup_many_chunk_size = 500
+    _sql_lookup_many = "SELECT {}, {} FROM {} WHERE {} IN ({{}})".format(
+        k, v, t, k)
+    _sql_lookup_many_chunk = _sql_lookup_many.format(
+        ", ".join(["?"] * _lookup_many_chunk_size))
+
     # Query for listing all key, value pairs
     _sql_list_items = "SELECT {}, {} FROM {} ORDER BY {} ASC".format(k, v, t, k)
     if multidict:
@@ -60,14 +71,19 @@ def make_database_dict_class(table, key="key", value="value", multidict=False):
     # Query for deleting a specific key
     _sql_delete = "DELETE FROM {} WHERE {} = ?".format(t, k)
 
+    # Query for deleting a specific key, value pair
+    _sql_delete_item = "DELETE FROM {} WHERE {} = ? AND {} = ?".format(t, k, v)
+
     # Queries for inserting a new key, value pair into the database, or updating
-    # an existing value
+    # an existing value. The value is only bound once and referenced via the
+    # "excluded" table in case of a conflict. In a multidict, an existing
+    # key, value pair is left as it is.
     if multidict:
-        _sql_upsert = "INSERT INTO {}({}, {}) VALUES (?, ?) ON CONFLICT({}, {}) DO UPDATE SET {}= ?".format(
-            t, k, v, k, v, v)
-    else:
-        _sql_upsert = "INSERT INTO {}({}, {}) VALUES (?, ?) ON CONFLICT({}) DO UPDATE SET {}= ?".format(
+        _sql_upsert = "INSERT INTO {}({}, {}) VALUES (?, ?) ON CONFLICT({}, {}) DO NOTHING".format(
             t, k, v, k, v)
+    else:
+        _sql_upsert = "INSERT INTO {}({}, {}) VALUES (?, ?) ON CONFLICT({}) DO UPDATE SET {}=excluded.{}".format(
+            t, k, v, k, v, v)
 
     # Query for clearing the entire dictionary
     _sql_clear = "DELETE FROM {}".format(t)
@@ -202,18 +218,42 @@ def make_database_dict_class(table, key="key", value="value", multidict=False):
 
             @param key is the key that should be looked up.
             """
-            with Transaction(self.db) as t:
-                t.execute(_sql_lookup, (key, ))
+            # Reads consist of a single statement, which is atomic by itself,
+            # so they are executed without a Transaction
+            c = self.db.conn.execute(_sql_lookup, (key, ))
+            if multidict:
+                x = c.fetchall()
+                return None if len(x) == 0 else set(map(lambda x: x[0], x))
+            else:
+                x = c.fetchone()
+                return None if x is None else x[0]
+
+        def lookup_many(self, keys):
+            """
+            Looks up all given keys using a single query. Returns a dictionary
+            containing the keys that exist alongside their associated values.
+
+            @param keys is an iterable of keys.
+            """
+            res, keys = {}, iter(keys)
+            while True:
+                chunk = tuple(islice(keys, _lookup_many_chunk_size))
+                if not chunk:
+                    return res
+                if len(chunk) == _lookup_many_chunk_size:
+                    sql = _sql_lookup_many_chunk
+                else:
+                    sql = _sql_lookup_many.format(", ".join(["?"] * len(chunk)))
+                c = self.db.conn.execute(sql, chunk)
                 if multidict:
-                    x = t.fetchall()
-                    return None if len(x) == 0 else set(map(lambda x: x[0], x))
+                    for key, value in c:
+                        res.setdefault(key, set()).add(value)
                 else:
-                    return t.fetchone()[0]
+                    res.update(c)
 
         def __contains__(self, key):
-            with Transaction(self.db) as t:
-                t.execute(_sql_contains, (key, ))
-                return bool(t.fetchone())
+            return not self.db.conn.execute(
+                _sql_contains, (key, )).fetchone() is None
 
         def __delitem__(self, key):
             with Transaction(self.db) as t:
@@ -233,15 +273,45 @@ def make_database_dict_class(table, key="key", value="value", multidict=False):
                         value, set) or isinstance(value, tuple)):
                     t.execute(_sql_delete, (key,))
                     for v in value:
-                        t.execute(_sql_upsert, (key, v, v))
+                        t.execute(_sql_upsert, (key, v))
                 else:
-                    t.execute(_sql_upsert, (key, value, value))
+                    t.execute(_sql_upsert, (key, value))
                 return value
 
-        def __len__(self):
+        def update(self, items):
+            """
+            Assigns all (key, value) pairs in the given dictionary or iterable.
+            This is equivalent to assigning each pair individually, but inserts
+            the values using a single batched statement.
+            """
+            if hasattr(items, "items"):
+                items = items.items()
             with Transaction(self.db) as t:
-                t.execute(_sql_len)
-                return t.fetchone()[0]
+                rows = []
+                for key, value in items:
+                    if multidict and isinstance(value, (list, set, tuple)):
+                        # Flush pending rows before deleting the key, such
+                        # that the order of the assignments is preserved
+                        if rows:
+                            t.executemany(_sql_upsert, rows)
+                            rows = []
+                        t.execute(_sql_delete, (key,))
+                        rows.extend((key, v) for v in value)
+                    else:
+                        rows.append((key, value))
+                t.executemany(_sql_upsert, rows)
+
+        def discard_items(self, items):
+            """
+            Deletes all given (key, value) pairs from the dictionary. Pairs that
+            do not exist are ignored. For multidicts, this removes individual
+            values from the set associated with a key.
+            """
+            with Transaction(self.db) as t:
+                t.executemany(_sql_delete_item, items)
+
+        def __len__(self):
+            return self.db.conn.execute(_sql_len).fetchone()[0]
 
         def items(self):
             return ItemsIterator(self.db)
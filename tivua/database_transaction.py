@@ -22,6 +22,8 @@ instance.
 @author Andreas Stöckel
 """
 
+from itertools import starmap
+
 ################################################################################
 # LOGGING                                                                      #
 ###############################################################################
@@ -44,6 +46,11 @@ class Transaction:
     rolled back.
 
     The Transaction class implements part of the Cursor interface.
+
+    Read-only transactions (readonly=True) do not create a savepoint, since
+    there is nothing to roll back. They should only be used for transactions
+    that execute a single statement, or that are nested within another
+    transaction, as the statements are otherwise not isolated from each other.
     """
 
     UID = 0
@@ -55,8 +62,9 @@ class Transaction:
         def __getitem__(self, key):
             return None
 
-    def __init__(self, db):
+    def __init__(self, db, readonly=False):
         self.db = db
+        self.readonly = readonly
         self.cursor = None
         self.level = None
         self.savepoint = None
@@ -78,12 +86,16 @@ class Transaction:
         # Set this transaction as the current transaction
         self.db.transaction = self
 
+        # Read-only transactions merely need a cursor
+        self.cursor = self.db.conn.cursor()
+        if self.readonly:
+            return self
+
         # Create a unique savepoint name
         Transaction.UID += 1
         self.savepoint = "sp_{:x}_{}".format(Transaction.UID, self.level)
 
         # Start a new sqlite transaction
-        self.cursor = self.db.conn.cursor()
         self.cursor.execute("SAVEPOINT {}".format(self.savepoint))
 
         return self
@@ -97,9 +109,10 @@ class Transaction:
 
         # Either rollback or commit the transaction, depending on whether
         # there was an exception
-        if not exc_type is None:
-            self.cursor.execute("ROLLBACK TO {}".format(self.savepoint))
-        self.cursor.execute("RELEASE {}".format(self.savepoint))
+        if not self.savepoint is None:
+            if not exc_type is None:
+                self.cursor.execute("ROLLBACK TO {}".format(self.savepoint))
+            self.cursor.execute("RELEASE {}".format(self.savepoint))
 
         # Reset the level and cursor variables
         self.level, self.parent, self.savepoint, self.cursor = [None] * 4
@@ -107,6 +120,9 @@ class Transaction:
     def execute(self, *args, **kwargs):
         return self.cursor.execute(*args, **kwargs)
 
+    def executemany(self, *args, **kwargs):
+        return self.cursor.executemany(*args, **kwargs)
+
     def fetchone(self, *args, **kwargs):
         res = self.cursor.fetchone(*args, **kwargs)
         if res is None:
@@ -120,9 +136,10 @@ class Transaction:
     def fetchall(self, *args, **kwargs):
         return self.cursor.fetchall(*args, **kwargs)
 
-    def fetchall_dataclass(self, D, *args, **kwargs):
-        return list(
-            map(lambda x: D(*x), self.cursor.fetchall(*args, **kwargs)))
+    def fetchall_dataclass(self, D):
+        # Construct the dataclass instances while iterating over the cursor;
+        # this avoids materialising an intermediate list of row tuples
+        return list(starmap(D, self.cursor))
 
     @property
     def rowcount(self):
@@ -267,11 +267,14 @@ def main_serve(args):
     # Initialise the API and parse default parameters
     api = _init(args, perform_initialisation=True)
 
+    # Server class periodically purging stale sessions from the database
+    TCPServer = tivua.server.create_tcp_server_class(api)
+
     # Open the database connection
     with api:
         # Start the HTTP server
         Server = tivua.server.create_server_class(api, args)
-        with socketserver.TCPServer((args.bind, args.port), Server) as httpd:
+        with TCPServer((args.bind, args.port), Server) as httpd:
             logger.info("Serving on http://{}:{}/".format(
                 args.bind, args.port))
             try:
@@ -308,7 +311,7 @@ def main_import(args):
             logger.warning(
                 'Writing database backup to \"{}\"'.format(backup_filename))
             with open(backup_filename, 'w') as backup_file:
-                json.dump(api.export_to_object(), backup_file, indent=4)
+                api.export_to_stream(backup_file)
                 backup_file.write("\n")
 
             try:
@@ -427,7 +430,7 @@ def main_export(args):
     The "export" sub-program.
     """
 
-    import json, sys
+    import sys
 
     # Parse the command line arguments
     api = _init(args)
@@ -442,12 +445,9 @@ def main_export(args):
 
     try:
         with api:
-            # Write the database to a Python object
-            obj = api.export_to_object(
-                export_passwords=not args.no_export_passwords)
-
-            # Serialise the object
-            json.dump(obj, file, indent=4)
+            # Serialise the database to the target file
+            api.export_to_stream(
+                file, export_passwords=not args.no_export_passwords)
         file.write("\n")
     finally:
         # Make sure to close the input file
@@ -24,6 +24,9 @@ programs are not installed.
 @author Andreas Stöckel
 """
 
+import os
+import subprocess
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -58,7 +61,6 @@ class Minify:
     def _search_npm_executable(exe):
         # First try to search the executable within the "./node_modules/"
         # subdirectory
-        import os
         local_npm_exe = os.path.abspath(os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
             "../node_modules/.bin/{}".format(exe)
@@ -78,7 +80,6 @@ class Minify:
         """
 
         def exec_(data, args):
-            import subprocess
             try:
                 with subprocess.Popen(
                         [Minify._search_npm_executable(args[0])] + args[1:],
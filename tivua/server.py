@@ -17,7 +17,10 @@
 import re, os
 import http.server
 import json
+import socketserver
+import sqlite3
 import traceback
+from urllib.parse import parse_qs
 
 from tivua.api import *
 from tivua.database_filters import *
@@ -745,8 +748,6 @@ class Router:
 
     @staticmethod
     def _parse_path(path):
-        from urllib.parse import parse_qs
-
         # Reject malicious paths
         if (len(path) == 0) or (path[0] != '/') or (".." in path):
             return None, None
@@ -795,6 +796,32 @@ class Router:
 ################################################################################
 
 
+def create_tcp_server_class(api):
+    """
+    Creates a TCPServer class that periodically deletes stale challenges and
+    sessions and performs database maintenance. service_actions() is called by serve_forever() on the main
+    thread, which is important, since the database connection must not be
+    shared between threads. The API only actually purges the tables and runs
+    the maintenance tasks every once in a while.
+
+    Database errors (e.g., another process holding the write lock) must not
+    stop the server; they are logged and the task is retried the next time.
+    """
+
+    class TCPServer(socketserver.TCPServer):
+        def service_actions(self):
+            try:
+                api.purge_stale()
+            except sqlite3.Error:
+                logger.exception("Error while purging stale sessions")
+            try:
+                api.maintenance()
+            except sqlite3.Error:
+                logger.exception("Error while performing database maintenance")
+
+    return TCPServer
+
+
 def create_server_class(api, args):
     from tivua.bundle import bundle
 
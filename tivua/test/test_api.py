@@ -159,8 +159,12 @@ def test_delete_user():
         posts = api.get_post_list(start=0, limit=-1)
         assert(len(posts) == 3)
 
+        # Users with posts are only deleted if "force" is set
+        assert api.delete_user(user["uid"]) == False
+        assert len(api.get_user_list()) == 3
+
         # Delete the user
-        api.delete_user(user["uid"], force=True)
+        assert api.delete_user(user["uid"], force=True) == True
         users = api.get_user_list()
         print(users)
         assert(len(users) == 2)
@@ -181,3 +185,172 @@ def test_delete_user():
         assert posts[2]["cuid"] == 1
         assert posts[2]["muid"] == 1
         assert posts[2]["author"] == 0
+
+        # The post history no longer references the user either
+        for history in (False, True, None):
+            assert api.db.count_user_posts(user["uid"], history=history) == 0
+
+
+def test_login():
+    import hashlib
+
+    def response(password, salt, challenge):
+        password_hash = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"),
+                                            bytes.fromhex(salt),
+                                            API.PBKDF2_COUNT)
+        return hashlib.pbkdf2_hmac("sha256", password_hash,
+                                   bytes.fromhex(challenge),
+                                   API.PBKDF2_COUNT).hex()
+
+    with API(Database()) as api:
+        password, user = api.create_user("jdoe", role="author")
+
+        # Login with the correct password
+        c = api.get_password_login_challenge()
+        r = response(password, c["salt"], c["challenge"])
+        session = api.login_method_username_password("jdoe", c["challenge"], r)
+        assert session["uid"] == user["uid"]
+        assert session["name"] == "jdoe"
+        assert api.get_session_data(session["sid"])["uid"] == user["uid"]
+
+        # Challenges can only be used once
+        with pytest.raises(AuthentificationError):
+            api.login_method_username_password("jdoe", c["challenge"], r)
+
+        # Wrong password
+        c = api.get_password_login_challenge()
+        r = response("foo", c["salt"], c["challenge"])
+        with pytest.raises(AuthentificationError):
+            api.login_method_username_password("jdoe", c["challenge"], r)
+
+        # Invalid challenge format
+        with pytest.raises(ValidationError):
+            api.login_method_username_password("jdoe", "foo", r)
+
+        # Logging out invalidates the session
+        api.logout(session["sid"])
+        assert api.get_session_data(session["sid"]) is None
+
+        # Resetting the password invalidates the old password
+        new_password = api.reset_user_password(user_name="jdoe")
+        c = api.get_password_login_challenge()
+        r = response(password, c["salt"], c["challenge"])
+        with pytest.raises(AuthentificationError):
+            api.login_method_username_password("jdoe", c["challenge"], r)
+        c = api.get_password_login_challenge()
+        r = response(new_password, c["salt"], c["challenge"])
+        assert api.login_method_username_password("jdoe", c["challenge"],
+                                                  r)["uid"] == user["uid"]
+
+        # Deactivated users cannot login
+        api.set_user_role("inactive", user_name="jdoe")
+        c = api.get_password_login_challenge()
+        r = response(new_password, c["salt"], c["challenge"])
+        with pytest.raises(AuthentificationError):
+            api.login_method_username_password("jdoe", c["challenge"], r)
+
+
+def test_post_keywords():
+    with API(Database()) as api:
+        post1 = api.create_post({
+            "cuid": 1,
+            "content": "Foo",
+            "keywords": "foo, bar",
+            "date": 12354678,
+        })
+        post2 = api.create_post({
+            "cuid": 1,
+            "content": "Bar",
+            "keywords": "bar",
+            "date": 12354678,
+        })
+        assert post1["keywords"] == ["foo", "bar"]
+        assert api.get_keyword_list() == {"bar": 2, "foo": 1}
+
+        # Update the keywords of the first post
+        post1["keywords"] = "bar, baz"
+        post1 = api.update_post(post1)
+        assert post1["keywords"] == ["bar", "baz"]
+        assert post1["revision"] == 1
+        assert api.get_keyword_list() == {"bar": 2, "baz": 1}
+
+        # Delete the second post
+        api.delete_post(post2["pid"])
+        assert api.get_keyword_list() == {"bar": 1, "baz": 1}
+
+
+def test_export_import(monkeypatch):
+    import io, json
+
+    with API(Database()) as api:
+        _, user = api.create_user("jdoe", role="author")
+        post = api.create_post({
+            "cuid": user["uid"],
+            "content": "Foo\nBar",
+            "keywords": "foo, bar",
+            "date": 12354678,
+        })
+        post["content"] = "Baz"
+        api.update_post(post)
+        post2 = api.create_post({
+            "cuid": user["uid"],
+            "content": "Qux",
+            "keywords": "foo",
+            "date": 12354679,
+        })
+        api.update_user_settings(user["uid"], {"foo": [1, 2]})
+
+        # Streaming the export produces the same output as serialising the
+        # exported object
+        for export_passwords in (False, True):
+            fp = io.StringIO()
+            api.export_to_stream(fp, export_passwords=export_passwords)
+            obj = api.export_to_object(export_passwords=export_passwords)
+            assert fp.getvalue() == json.dumps(obj, indent=4)
+            assert [p["content"] for p in json.loads(fp.getvalue())["posts"]] \
+                == ["Qux", "Baz"]
+
+    # Importing the export restores posts, users, keywords and settings; use
+    # a small chunk size to import the posts in multiple batches
+    monkeypatch.setattr(API, "IMPORT_CHUNK_SIZE", 1)
+    with API(Database()) as api:
+        api.import_from_object(json.loads(fp.getvalue()))
+        assert api.get_keyword_list() == {"bar": 1, "foo": 2}
+        assert api.get_post(post["pid"])["content"] == "Baz"
+        assert api.get_post(post2["pid"])["content"] == "Qux"
+        assert api.get_user_list()[user["uid"]]["name"] == "jdoe"
+        assert api.get_user_settings(user["uid"]) == {"foo": [1, 2]}
+
+
+def test_configuration_object():
+    with API(Database()) as api:
+        # Modifying the returned object must not affect the cached object
+        obj = api.get_configuration_object()
+        obj["login_methods"]["cas"] = "foo"
+        obj["salt"] = "bar"
+        obj2 = api.get_configuration_object()
+        assert obj2["login_methods"]["cas"] is False
+        assert obj2["salt"] == api.db.configuration["salt"]
+
+
+def test_user_settings():
+    with API(Database()) as api:
+        assert api.get_user_settings(1) == {}
+
+        # Settings are merged with the previously stored settings
+        assert api.update_user_settings(1, {"a": 1}) == {"a": 1}
+        assert api.update_user_settings(1, {"b": "ä"}) == {"a": 1, "b": "ä"}
+        assert api.update_user_settings(1, {"a": 2}) == {"a": 2, "b": "ä"}
+        assert api.get_user_settings(1) == {"a": 2, "b": "ä"}
+
+        # Settings objects must not exceed the maximum length
+        with pytest.raises(ValidationError):
+            api.update_user_settings(1, {"c": "x" * API.MAX_SETTINGS_LEN})
+        with pytest.raises(ValidationError):
+            api.update_user_settings(1, None)
+        assert api.get_user_settings(1) == {"a": 2, "b": "ä"}
+
+        # The limit applies to the stored, ASCII-escaped representation
+        with pytest.raises(ValidationError):
+            api.update_user_settings(1, {"c": "ä" * (API.MAX_SETTINGS_LEN // 4)})
+        assert api.db.settings[1] == '{"a": 2, "b": "\\u00e4"}'
@@ -17,6 +17,7 @@
 import pytest
 
 from tivua.database import *
+from tivua.database import SchemaOutOfDateError
 from tivua.database_filters import *
 
 import time
@@ -43,6 +44,39 @@ def test_transactions():
         # We should be back to the original state
         assert db.settings[4] == "foo"
 
+        # Read-only transactions do not interfere with the enclosing
+        # transaction
+        try:
+            with Transaction(db) as t:
+                db.settings[4] = "foo3"
+                with Transaction(db, readonly=True) as t2:
+                    t2.execute("SELECT obj FROM settings WHERE uid=4")
+                    assert t2.fetchone()[0] == "foo3"
+                raise Exception("Test")
+        except:
+            pass
+        assert db.settings[4] == "foo"
+        assert db.transaction is None
+
+
+def test_schema_check(tmp_path):
+    filename = str(tmp_path / "tivua.sqlite")
+
+    # Reopening a database with an up-to-date schema must succeed
+    with Database(filename) as db:
+        db.settings[1] = "foo"
+    with Database(filename) as db:
+        assert db.settings[1] == "foo"
+
+    # Change the schema of one of the tables
+    with Database(filename) as db:
+        db.conn.execute("DROP TABLE settings")
+        db.conn.execute("CREATE TABLE settings(uid INT PRIMARY KEY, obj BLOB)")
+
+    with pytest.raises(SchemaOutOfDateError):
+        with Database(filename) as db:
+            pass
+
 
 def test_keywords_dict():
     with Database(':memory:') as db:
@@ -165,6 +199,16 @@ def test_cache_dict():
         assert list(cache.values()) == [b"test", b"test2"]
         assert list(cache.key_counts()) == [("bar", 1), ("foo", 1)]
 
+        # Look up multiple keys at once; missing keys are omitted
+        assert cache.lookup_many(["foo", "bar", "baz"]) == {
+            "foo": b"test2", "bar": b"test"}
+        assert cache.lookup_many([]) == {}
+
+        # Large numbers of keys are looked up in multiple chunks
+        assert cache.lookup_many(
+            ["x{}".format(i) for i in range(1200)] + ["foo"]) == {
+                "foo": b"test2"}
+
         # Delete an entry from the dictionary
         del cache["bar"]
 
@@ -190,6 +234,34 @@ def test_session_management():
         assert db.get_session_uid("foo") is None
         assert db.delete_session("foo") == False
 
+        # Lookup the user associated with a session
+        user = User(name="jdoe", display_name="John Doe")
+        user.uid = db.create_user(user)
+        db.create_session("bar", user.uid)
+        db.create_session("baz", user.uid + 1)
+        assert db.get_session_user("bar") == user
+        assert db.get_session_user("baz") is None
+        assert db.get_session_user("foo") is None
+
+        # Sessions exceeding the maximum age are not updated
+        assert db.update_session_mtime("bar", 10) == True
+        assert db.update_session_mtime("bar", -1) == False
+        assert db.update_session_mtime("foo", 10) == False
+
+
+def test_challenges():
+    with Database(':memory:') as db:
+        db.challenges["foo"] = db.now()
+        db.challenges["bar"] = db.now()
+
+        # Challenges can only be consumed once
+        assert db.consume_challenge("foo", 10) == True
+        assert db.consume_challenge("foo", 10) == False
+
+        # Stale challenges cannot be consumed
+        assert db.consume_challenge("bar", -1) == False
+        assert "bar" in db.challenges
+
 
 @pytest.mark.skip(reason="Slow test")
 def test_session_management_timeouts():
@@ -248,6 +320,7 @@ def test_user_management():
 
         # Create two users
         assert len(db.list_users()) == 0
+        assert db.get_admin_user() is None
         assert db.create_user(user_1) == 2
         assert db.create_user(user_2) == 3
 
@@ -262,6 +335,7 @@ def test_user_management():
         assert db.get_user_by_id(user_2.uid) == user_2
         assert db.get_user_by_name("jdoe3") is None
         assert db.get_user_by_id(100) is None
+        assert db.get_admin_user() == user_1
 
         assert db.delete_user(100) == False
         assert db.delete_user(user_2.uid) == True
@@ -365,3 +439,39 @@ def test_fulltext():
         assert db.match_fulltext("test") == []
         assert db.delete_fulltext(1) == False
         assert db.match_fulltext("foo") == [2]
+
+        # Batched updates
+        db.update_fulltext_many([
+            (1, "first batch"),
+            (2, Post(content="second batch", keywords="foo,baz")),
+        ])
+        assert db.match_fulltext("batch") == [1, 2]
+        assert db.match_fulltext("foo") == [2]
+        assert db.match_fulltext("baz") == [2]
+        assert db.match_fulltext("bar") == []
+
+
+def test_keywords_dict_batch():
+    with Database(':memory:') as db:
+        keywords = db.keywords
+
+        # Insert multiple pairs at once
+        keywords.update([("foo", 1), ("bar", 2), ("foo", 3)])
+        assert list(keywords.items()) == [("bar", {2,}), ("foo", {1, 3})]
+
+        # Assigning a set replaces all values
+        keywords.update({"foo": {4, 5}, "baz": [6]})
+        assert list(keywords.items()) == [("bar", {2,}), ("baz", {6,}),
+                                          ("foo", {4, 5})]
+
+        # Remove individual pairs, ignore non-existing pairs
+        keywords.discard_items([("foo", 4), ("bar", 2), ("bar", 7)])
+        assert list(keywords.items()) == [("baz", {6,}), ("foo", {5,})]
+        assert keywords.lookup_many(["foo", "baz", "bar"]) == {
+            "baz": {6,}, "foo": {5,}}
+
+        # Regular dictionaries override existing values
+        cache = db.cache
+        cache.update({"foo": b"bar", "bar": b"test"})
+        cache.update([("foo", b"test2")])
+        assert list(cache.items()) == [("bar", b"test"), ("foo", b"test2")]
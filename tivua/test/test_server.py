@@ -0,0 +1,57 @@
+#   Tivua -- Shared research blog
+#   Copyright (C) 2019  Andreas Stöckel
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+import sqlite3
+
+from tivua.api import API
+from tivua.database import Database
+from tivua.server import create_tcp_server_class
+
+import logging
+#logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.DEBUG)
+
+
+def test_service_actions_locked_database(tmp_path):
+    filename = str(tmp_path / "tivua.sqlite")
+    with API(Database(filename)) as api:
+        # Do not wait for the lock to be released
+        api.db.conn.execute("PRAGMA busy_timeout=0")
+
+        # Create the server class without binding to an actual socket
+        TCPServer = create_tcp_server_class(api)
+        server = TCPServer(("127.0.0.1", 0), None, bind_and_activate=False)
+        try:
+            # Let another connection hold the write lock, as a concurrently
+            # running command line tool would
+            other = sqlite3.connect(filename, isolation_level=None)
+            other.execute("BEGIN IMMEDIATE")
+            try:
+                with pytest.raises(sqlite3.OperationalError):
+                    api.purge_stale()
+                server.service_actions()
+                assert api._last_session_purge is None
+                assert api._last_maintenance is None
+            finally:
+                other.execute("ROLLBACK")
+                other.close()
+
+            # The tasks are retried once the lock is released
+            server.service_actions()
+            assert not api._last_session_purge is None
+            assert not api._last_maintenance is None
+        finally:
+            server.server_close()